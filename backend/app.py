@@ -1,15 +1,17 @@
 # app.py
-import os, json, io, time, base64
+import os, io, time, base64, atexit
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
 import torch
-import torch.nn as nn
-from torchvision import models
-from torchvision.models import VGG16_Weights
 from PIL import Image
 
-from utils import process_image, predict_class, get_confidence_scores
+from utils import (process_image, process_raw_rgb, image_size, predict_class,
+                   get_confidence_scores, RAW_RGB_CONTENT_TYPE, INPUT_SIZE)
+from model_loader import load_class_names, load_model
+from similarity import extract_embedding, GalleryIndex
+from capture import CaptureSink
+from optimize import optimize_model, benchmark
 
 app = Flask(__name__)
 CORS(app)
@@ -17,6 +19,9 @@ CORS(app)
 # ====== Paths (có thể override bằng biến môi trường) ======
 MODEL_PATH   = os.getenv("MODEL_PATH",   "model/vgg16_fruit_model_2cls.pth")
 CLASSES_JSON = os.getenv("CLASSES_JSON", "model/classes.json")
+GALLERY_DIR  = os.getenv("GALLERY_DIR",  "model/gallery")
+CAPTURE_DIR  = os.getenv("CAPTURE_DIR",  "")  # rỗng = tắt capture ảnh độ tin cậy thấp
+OPT_CACHE_DIR = os.getenv("OPT_CACHE_DIR", "model/.cache")  # cache TorchScript / Inductor
 
 # ====== Meta / cấu hình trả về ======
 MODEL_META = {
@@ -25,92 +30,75 @@ MODEL_META = {
 }
 DEFAULT_THRESHOLD = float(os.getenv("DEFAULT_THRESHOLD", "70.0"))  # % cho cảnh báo
 TOPK = int(os.getenv("TOPK", "3"))
+SIMILAR_TOPK = int(os.getenv("SIMILAR_TOPK", "5"))
 
-# ====== Load classes.json (hỗ trợ nhiều format) ======
-def load_class_names(default=("bad_fruit","good_fruit")):
-    """
-    Hỗ trợ:
-    1) {"classes": ["bad_fruit","good_fruit"]}
-    2) ["bad_fruit","good_fruit"]
-    3) {"0":"bad_fruit","1":"good_fruit"} (mapping index->name)
-    """
-    try:
-        with open(CLASSES_JSON, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        if isinstance(data, dict) and "classes" in data and isinstance(data["classes"], list):
-            classes = data["classes"]
-        elif isinstance(data, list):
-            classes = data
-        elif isinstance(data, dict):  # mapping index->name
-            try:
-                keys = sorted(data.keys(), key=lambda k: int(k))
-            except Exception:
-                keys = sorted(data.keys())
-            classes = [data[k] for k in keys]
-        else:
-            raise ValueError("Định dạng classes.json không hợp lệ.")
+# ====== Chế độ suy luận CPU: eager | torchscript | compile ======
+INFERENCE_MODE  = os.getenv("INFERENCE_MODE", "eager")
+INFERENCE_BENCH = os.getenv("INFERENCE_BENCH", "0") == "1"  # đo latency theo batch size lúc khởi động
+INFERENCE_BENCH_BATCHES = [int(b) for b in os.getenv("INFERENCE_BENCH_BATCHES", "1,4,8").split(",")]
 
-        if not isinstance(classes, list) or len(classes) < 2:
-            raise ValueError("Danh sách lớp không hợp lệ.")
-        return classes
+# ====== Capture ảnh độ tin cậy thấp ======
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+CAPTURE_QUEUE       = int(os.getenv("CAPTURE_QUEUE", "256"))
+CAPTURE_SHARD_MB    = float(os.getenv("CAPTURE_SHARD_MB", "64"))
+CAPTURE_QUOTA_MB    = float(os.getenv("CAPTURE_QUOTA_MB", "2048"))
+CAPTURE_MODE        = os.getenv("CAPTURE_MODE", "low_confidence")  # "all" = ghi mọi request (để replay.py)
 
-    except Exception as e:
-        print(f"⚠️ Không đọc được classes.json, dùng mặc định: {e}")
-        return list(default)
-
-CLASS_NAMES = load_class_names()
+CLASS_NAMES = load_class_names(CLASSES_JSON)
 NUM_CLASSES = len(CLASS_NAMES)
 
-# ====== Build & Load model ======
-def build_model(num_classes: int) -> torch.nn.Module:
-    model = models.vgg16(weights=VGG16_Weights.DEFAULT)
-    for p in model.features.parameters():
-        p.requires_grad = False
-    model.classifier[6] = nn.Linear(4096, num_classes)
-    return model
-
-def _extract_state_dict(state):
-    """
-    Trả về state_dict thuần từ nhiều kiểu checkpoint:
-    - state là dict các weights
-    - state có key 'state_dict' hoặc 'model_state_dict'
-    - keys có prefix '_orig_mod.' (khi dùng torch.compile) -> strip
-    """
-    if isinstance(state, dict):
-        if "model_state_dict" in state and isinstance(state["model_state_dict"], dict):
-            state = state["model_state_dict"]
-        elif "state_dict" in state and isinstance(state["state_dict"], dict):
-            state = state["state_dict"]
-
-    if isinstance(state, dict) and all(isinstance(k, str) for k in state.keys()):
-        if any(k.startswith("_orig_mod.") for k in state.keys()):
-            state = {k.replace("_orig_mod.", ""): v for k, v in state.items()}
-    return state
-
-def load_model():
-    try:
-        print("🔄 Loading VGG16...")
-        model = build_model(NUM_CLASSES)
-        if os.path.exists(MODEL_PATH):
-            raw = torch.load(MODEL_PATH, map_location="cpu")
-            state = _extract_state_dict(raw)
-            try:
-                model.load_state_dict(state, strict=True)
-            except Exception as e:
-                print(f"⚠️ strict=True fail: {e} → thử strict=False")
-                model.load_state_dict(state, strict=False)
-            print(f"✅ Loaded weights: {MODEL_PATH}")
-        else:
-            print(f"⚠️ Không tìm thấy model tại: {MODEL_PATH} (hãy train trước)")
+model = load_model(MODEL_PATH, NUM_CLASSES)
 
-        model.eval()
-        return model
+# model eager giữ nguyên cho /embed (cần truy cập features/classifier); /predict dùng infer_model
+infer_model, INFERENCE_INFO = model, {"mode": "eager"}
+if model is not None:
+    infer_model, INFERENCE_INFO = optimize_model(model, INFERENCE_MODE, OPT_CACHE_DIR, MODEL_PATH, NUM_CLASSES)
+    if INFERENCE_BENCH:
+        INFERENCE_INFO["latency_ms"] = benchmark(infer_model, INFERENCE_BENCH_BATCHES)
+        print(f"⏱️ Latency ({INFERENCE_INFO['mode']}) ms/batch: {INFERENCE_INFO['latency_ms']}")
+
+# ====== Gallery index (tùy chọn, build bằng similarity.py) ======
+def load_gallery():
+    if not os.path.exists(os.path.join(GALLERY_DIR, "meta.json")):
+        print(f"ℹ️ Chưa có gallery tại: {GALLERY_DIR} (/similar bị tắt)")
+        return None
+    try:
+        index = GalleryIndex.load(GALLERY_DIR, mmap=True)
+        print(f"✅ Loaded gallery: {len(index)} ảnh ({index.embeddings.dtype})")
+        return index
     except Exception as e:
-        print("❌ Lỗi load model:", e)
+        print("❌ Lỗi load gallery:", e)
         return None
 
-model = load_model()
+gallery = load_gallery()
+
+capture = None
+if CAPTURE_DIR:
+    capture = CaptureSink(
+        CAPTURE_DIR,
+        sample_rate=CAPTURE_SAMPLE_RATE,
+        max_queue=CAPTURE_QUEUE,
+        shard_bytes=int(CAPTURE_SHARD_MB * 2**20),
+        quota_bytes=int(CAPTURE_QUOTA_MB * 2**20),
+    ).start()
+    atexit.register(capture.close)
+    print(f"📥 Capture ({CAPTURE_MODE}) → {CAPTURE_DIR}")
+
+def _read_uploads():
+    """Trả về list bytes từ form-data `file` (cho phép nhiều file)."""
+    files = [f for f in request.files.getlist("file") if f and f.filename]
+    return [f.read() for f in files]
+
+def _form_int(name, default=None):
+    try:
+        return int(request.form[name])
+    except (KeyError, ValueError):
+        return default
+
+def _embed_bytes(blobs):
+    x = torch.cat([process_image(b) for b in blobs], dim=0)  # (B,3,224,224)
+    with torch.inference_mode():
+        return extract_embedding(model, x)  # (B,4096)
 
 # ====== Endpoints ======
 @app.route("/", methods=["GET"])
@@ -121,7 +109,9 @@ def home():
         "endpoints": {
             "health":  "GET  /health",
             "labels":  "GET  /labels",
-            "predict": "POST /predict  form-data: file=<image>"
+            "predict": "POST /predict  form-data: file=<image> | file=<raw rgb8, application/x-rgb8>, orig_w, orig_h",
+            "embed":   "POST /embed    form-data: file=<image>",
+            "similar": "POST /similar  form-data: file=<image>[, file=...], k=<int>"
         }
     })
 
@@ -133,7 +123,12 @@ def health():
         "num_classes": NUM_CLASSES,
         "classes": CLASS_NAMES,
         "model_path": MODEL_PATH,
-        "model_meta": MODEL_META
+        "model_meta": MODEL_META,
+        "inference": INFERENCE_INFO,
+        "gallery_size": len(gallery) if gallery is not None else 0,
+        "capture": capture.snapshot() if capture is not None else None,
+        # FE đọc để quyết định có resize + gửi raw RGB hay không
+        "fast_path": {"raw_rgb": RAW_RGB_CONTENT_TYPE, "input_size": INPUT_SIZE}
     })
 
 @app.route("/labels", methods=["GET"])
@@ -158,20 +153,32 @@ def predict():
 
         # Đọc bytes 1 lần để lấy kích thước gốc + tiền xử lý
         raw_bytes = file.read()
-
-        # Kích thước ảnh gốc để hiển thị ở FE
-        try:
-            _img = Image.open(io.BytesIO(raw_bytes)).convert("RGB")
-            orig_w, orig_h = _img.size
-        except Exception:
-            orig_w, orig_h = None, None
+        is_raw = file.mimetype == RAW_RGB_CONTENT_TYPE
 
         # Tiền xử lý & suy luận (đo thời gian)
         t0 = time.time()
-        img_tensor = process_image(raw_bytes)  # (1,3,224,224)
+        if is_raw:
+            # Fast path: client đã resize 224x224 và gửi pixel RGB → bỏ decode + resize
+            try:
+                img_tensor = process_raw_rgb(raw_bytes,
+                                             _form_int("width", INPUT_SIZE),
+                                             _form_int("height", INPUT_SIZE))
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+        else:
+            img_tensor = process_image(raw_bytes)  # (1,3,224,224)
+        preprocess_ms = round((time.time() - t0) * 1000, 2)
+
+        # Kích thước ảnh gốc để hiển thị ở FE (client resize thì gửi kèm orig_w/orig_h)
+        orig_w, orig_h = _form_int("orig_w"), _form_int("orig_h")
+        if (orig_w is None or orig_h is None) and not is_raw:
+            try:
+                orig_w, orig_h = image_size(raw_bytes)  # chỉ đọc header
+            except Exception:
+                orig_w, orig_h = None, None
 
-        with torch.no_grad():
-            output = model(img_tensor)  # [1, C]
+        with torch.inference_mode():
+            output = infer_model(img_tensor)  # [1, C]
             pred = predict_class(output, CLASS_NAMES)  # str
             scores_pct = get_confidence_scores(output, CLASS_NAMES)  # {label: %}
 
@@ -197,6 +204,21 @@ def predict():
         threshold_met = pred_pct >= DEFAULT_THRESHOLD
         note = None if threshold_met else "Độ tin cậy thấp, hãy thử ảnh rõ/đủ sáng hơn."
 
+        # Ảnh độ tin cậy thấp (hoặc mọi ảnh nếu CAPTURE_MODE=all) → queue capture (không block, đầy thì bỏ)
+        if capture is not None and (CAPTURE_MODE == "all" or not threshold_met):
+            capture.submit(raw_bytes, {
+                "format": "rgb8" if is_raw else "encoded",
+                "width": INPUT_SIZE if is_raw else orig_w,
+                "height": INPUT_SIZE if is_raw else orig_h,
+                "pred_class": pred,
+                "pred_pct": round(pred_pct, 2),
+                "scores": scores_pct,
+                "threshold_pct": DEFAULT_THRESHOLD,
+                "model_version": MODEL_META["version"],
+                # export_imagefolder chỉ lấy "low_confidence"; "traffic" là ảnh đủ tự tin, ghi thêm cho replay
+                "reason": "traffic" if threshold_met else "low_confidence",
+            })
+
         # ====== Tạo ảnh preview 224x224 (DENORMALIZE) trả về base64 ======
         # utils.process_image đã Normalize theo ImageNet -> cần khử Normalize
         try:
@@ -235,11 +257,14 @@ def predict():
 
             # Thời gian & input
             "timings": {
-                "inference_ms": inference_ms
+                "inference_ms": inference_ms,
+                "preprocess_ms": preprocess_ms
             },
             "input": {
                 "original_size": {"w": orig_w, "h": orig_h},
-                "preprocessed_size": {"w": 224, "h": 224}
+                "preprocessed_size": {"w": INPUT_SIZE, "h": INPUT_SIZE},
+                "format": "rgb8" if is_raw else "encoded",
+                "upload_bytes": len(raw_bytes)
             },
 
             # Meta model
@@ -253,6 +278,69 @@ def predict():
         print("❌ Predict error:", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/embed", methods=["POST"])
+def embed():
+    try:
+        if model is None:
+            return jsonify({"success": False, "error": "Model not loaded"}), 500
+
+        blobs = _read_uploads()
+        if not blobs:
+            return jsonify({"success": False, "error": "No file uploaded"}), 400
+
+        t0 = time.time()
+        emb = _embed_bytes(blobs)
+        return jsonify({
+            "success": True,
+            "dim": int(emb.shape[1]),
+            "embeddings": emb.tolist(),  # [B][4096], chưa normalize
+            "timings": {"inference_ms": round((time.time() - t0) * 1000, 2)}
+        })
+
+    except Exception as e:
+        print("❌ Embed error:", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/similar", methods=["POST"])
+def similar():
+    try:
+        if model is None:
+            return jsonify({"success": False, "error": "Model not loaded"}), 500
+        if gallery is None:
+            return jsonify({"success": False, "error": "Gallery not loaded"}), 503
+
+        blobs = _read_uploads()
+        if not blobs:
+            return jsonify({"success": False, "error": "No file uploaded"}), 400
+
+        try:
+            k = int(request.form.get("k", SIMILAR_TOPK))
+        except ValueError:
+            return jsonify({"success": False, "error": "k must be an integer"}), 400
+        if k < 1:
+            return jsonify({"success": False, "error": "k must be >= 1"}), 400
+
+        t0 = time.time()
+        emb = _embed_bytes(blobs).float().cpu().numpy()
+        t1 = time.time()
+        results = gallery.lookup(emb, k)  # 1 phép nhân ma trận cho cả batch
+        t2 = time.time()
+
+        return jsonify({
+            "success": True,
+            "k": min(k, len(gallery)),
+            "gallery_size": len(gallery),
+            "results": results,          # [query][rank] -> {rank, score, path, label}
+            "timings": {
+                "embed_ms": round((t1 - t0) * 1000, 2),
+                "search_ms": round((t2 - t1) * 1000, 2)
+            }
+        })
+
+    except Exception as e:
+        print("❌ Similar error:", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
 if __name__ == "__main__":
     print("🚀 Starting server...")
     print(f"📦 MODEL_PATH   = {MODEL_PATH}")
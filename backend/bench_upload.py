@@ -0,0 +1,73 @@
+# bench_upload.py
+"""
+So sánh 3 cách gửi ảnh lên /predict (không cần model):
+  1) full    : JPEG gốc độ phân giải đầy đủ → server decode + resize
+  2) jpeg224 : client resize 224x224, gửi JPEG nhỏ → server decode, bỏ resize
+  3) rgb8    : client resize 224x224, gửi raw RGB uint8 → server chỉ normalize
+
+Đo kích thước payload và CPU time phía server cho phần tiền xử lý
+(đọc kích thước gốc + process_image / process_raw_rgb).
+
+    python bench_upload.py [--image path/to/photo.jpg] [--repeats 30]
+"""
+import io, time, argparse
+
+import torch
+from PIL import Image, ImageFilter
+
+from utils import process_image, process_raw_rgb, image_size, INPUT_SIZE
+
+def synthetic_photo(w=4032, h=3024):
+    """Ảnh giả kích thước camera điện thoại (gradient + nhiễu để JPEG không quá nhỏ)."""
+    r = Image.linear_gradient("L").resize((w, h))
+    g = Image.radial_gradient("L").resize((w, h))
+    b = Image.effect_noise((w, h), 40).filter(ImageFilter.GaussianBlur(2))
+    return Image.merge("RGB", (r, g, b))
+
+def to_jpeg(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+def cpu_ms(fn, repeats):
+    fn()  # warmup
+    t0 = time.process_time()
+    for _ in range(repeats):
+        fn()
+    return (time.process_time() - t0) * 1000 / repeats
+
+def main():
+    ap = argparse.ArgumentParser(description="Payload & CPU: full JPEG vs client-resized")
+    ap.add_argument("--image", default=None)
+    ap.add_argument("--repeats", type=int, default=30)
+    ap.add_argument("--threads", type=int, default=1, help="torch threads (1 = CPU/request dễ so sánh)")
+    args = ap.parse_args()
+    torch.set_num_threads(args.threads)
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            full = f.read()
+        src = Image.open(io.BytesIO(full)).convert("RGB")
+    else:
+        src = synthetic_photo()
+        full = to_jpeg(src, 95)
+    small = src.resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR)
+    jpeg224 = to_jpeg(small, 90)   # giống canvas.toBlob("image/jpeg", 0.9)
+    rgb8 = small.tobytes()         # H*W*3
+
+    cases = {
+        "full":    (full,    lambda: (image_size(full), process_image(full))),
+        "jpeg224": (jpeg224, lambda: process_image(jpeg224)),
+        "rgb8":    (rgb8,    lambda: process_raw_rgb(rgb8)),
+    }
+    print(f"📷 Ảnh gốc: {src.size[0]}x{src.size[1]} | torch threads: {args.threads}\n")
+    print(f"{'path':<8} {'payload':>12} {'vs full':>8} {'server CPU':>12} {'vs full':>8}")
+    base_bytes, base_ms = len(full), None
+    for name, (payload, fn) in cases.items():
+        ms = cpu_ms(fn, args.repeats)
+        base_ms = base_ms or ms
+        print(f"{name:<8} {len(payload)/1024:>9.1f} KB {len(payload)/base_bytes:>7.1%} "
+              f"{ms:>9.2f} ms {ms/base_ms:>7.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# capture.py
+"""
+Thu thập ảnh độ tin cậy thấp để gán nhãn lại / train lại.
+
+Luồng request chỉ gọi CaptureSink.submit() (O(1), không bao giờ block):
+bytes gốc + metadata dự đoán được đẩy vào queue có giới hạn; đầy thì bỏ.
+Một thread nền ghi nối tiếp vào shard:
+    <capture_dir>/shard-00000.bin        bytes ảnh nối liền nhau
+    <capture_dir>/shard-00000.idx.jsonl  mỗi dòng: {"offset","length","sha1","ts", ...meta}
+Shard xoay vòng theo kích thước; tổng dung lượng (đã ghi + đang chờ trong queue) bị chặn bởi quota.
+Mặc định bỏ EXIF/GPS/text metadata trước khi ghi; index không chứa tên file hay IP.
+
+CLI export sang ImageFolder (cùng layout với processed_fruit_dataset_2cls.py):
+    python capture.py export --src captures --out relabel_dataset [--split train]
+"""
+import os, json, time, queue, random, hashlib, threading, argparse
+
+SHARD_PREFIX = "shard-"
+
+def _shard_paths(capture_dir, n):
+    base = os.path.join(capture_dir, f"{SHARD_PREFIX}{n:05d}")
+    return base + ".bin", base + ".idx.jsonl"
+
+def _list_shards(capture_dir):
+    if not os.path.isdir(capture_dir):
+        return []
+    ids = []
+    for f in os.listdir(capture_dir):
+        if f.startswith(SHARD_PREFIX) and f.endswith(".bin"):
+            try:
+                ids.append(int(f[len(SHARD_PREFIX):-len(".bin")]))
+            except ValueError:
+                pass
+    return sorted(ids)
+
+def _guess_ext(data: bytes) -> str:
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    if data[:2] == b"BM":
+        return ".bmp"
+    return ".bin"
+
+# APP1 (EXIF/XMP, có GPS), APP13 (IPTC), COM; giữ APP0/APP2 (ICC)/APP14 (Adobe) vì ảnh hưởng decode màu
+_JPEG_DROP = {0xE1, 0xED, 0xFE}
+_PNG_DROP = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME"}
+
+def strip_metadata(data: bytes) -> bytes:
+    """
+    Bỏ metadata (EXIF/GPS, text...) khỏi JPEG/PNG mà không re-encode pixel.
+    Định dạng khác hoặc file lỗi → trả nguyên bytes.
+    """
+    if data[:2] == b"\xff\xd8":
+        out, i = bytearray(b"\xff\xd8"), 2
+        while i + 4 <= len(data):
+            if data[i] != 0xFF:
+                return data
+            marker = data[i + 1]
+            if marker == 0xFF:                       # byte đệm
+                i += 1
+                continue
+            if marker == 0xDA:                       # SOS: phần còn lại là dữ liệu ảnh
+                out += data[i:]
+                return bytes(out)
+            if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                out += data[i:i + 2]
+                i += 2
+                continue
+            seg_end = i + 2 + int.from_bytes(data[i + 2:i + 4], "big")
+            if marker not in _JPEG_DROP:
+                out += data[i:seg_end]
+            i = seg_end
+        return data
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        out, i = bytearray(data[:8]), 8
+        while i + 12 <= len(data):
+            n = int.from_bytes(data[i:i + 4], "big")
+            kind = data[i + 4:i + 8]
+            if kind not in _PNG_DROP:
+                out += data[i:i + 12 + n]
+            i += 12 + n
+            if kind == b"IEND":
+                return bytes(out)
+        return data
+    return data
+
+class CaptureSink:
+    def __init__(self, capture_dir, sample_rate=1.0, max_queue=256,
+                 shard_bytes=64 * 2**20, quota_bytes=2 * 2**30, anonymize=True):
+        self.capture_dir = capture_dir
+        self.anonymize = bool(anonymize)
+        self.sample_rate = float(sample_rate)
+        self.shard_bytes = int(shard_bytes)
+        self.quota_bytes = int(quota_bytes)
+        self._q = queue.Queue(maxsize=int(max_queue))
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "sampled_out": 0, "dropped_full": 0,
+                      "dropped_quota": 0, "written": 0, "write_errors": 0}
+
+        os.makedirs(capture_dir, exist_ok=True)
+        shards = _list_shards(capture_dir)
+        self._shard_id = shards[-1] if shards else 0
+        self._used_bytes = sum(os.path.getsize(_shard_paths(capture_dir, i)[0]) for i in shards)
+        self._pending_bytes = 0  # đã xếp hàng nhưng chưa ghi → vẫn tính vào quota
+
+    # ---------- request thread ----------
+    def submit(self, data: bytes, meta: dict) -> bool:
+        """Không block: trả về True nếu đã xếp hàng, False nếu bị bỏ."""
+        self._bump("submitted")
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self._bump("sampled_out")
+            return False
+        n = len(data)
+        with self._lock:
+            if self._used_bytes + self._pending_bytes + n > self.quota_bytes:
+                self.stats["dropped_quota"] += 1
+                return False
+            self._pending_bytes += n
+        try:
+            self._q.put_nowait((data, dict(meta, ts=time.time())))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._pending_bytes -= n
+                self.stats["dropped_full"] += 1
+            return False
+
+    def _bump(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            out = dict(self.stats)
+            used, pending = self._used_bytes, self._pending_bytes
+        out.update(queue=self._q.qsize(), used_mb=round(used / 2**20, 2),
+                   pending_mb=round(pending / 2**20, 2),
+                   quota_mb=round(self.quota_bytes / 2**20, 2), shard=self._shard_id)
+        return out
+
+    # ---------- writer thread ----------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, timeout=5.0):
+        if self._thread is not None:
+            self._q.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _open_shard(self):
+        bin_path, idx_path = _shard_paths(self.capture_dir, self._shard_id)
+        return open(bin_path, "ab"), open(idx_path, "a", encoding="utf-8")
+
+    def _run(self):
+        fbin, fidx = self._open_shard()
+        try:
+            while True:
+                item = self._q.get()
+                if item is None:
+                    break
+                data, meta = item
+                reserved = len(data)
+                try:
+                    if self.anonymize and meta.get("format") != "rgb8":
+                        data = strip_metadata(data)  # làm ở thread nền, không tốn thời gian request
+                    with self._lock:
+                        # Check lại quota ngay trước khi ghi (strip_metadata có thể đổi kích thước)
+                        if self._used_bytes + len(data) > self.quota_bytes:
+                            self.stats["dropped_quota"] += 1
+                            continue
+                    offset = fbin.tell()
+                    if offset > 0 and offset + len(data) > self.shard_bytes:
+                        fbin.close(); fidx.close()
+                        self._shard_id += 1
+                        fbin, fidx = self._open_shard()
+                        offset = 0
+                    fbin.write(data)
+                    fbin.flush()
+                    rec = {"offset": offset, "length": len(data),
+                           "sha1": hashlib.sha1(data).hexdigest(), **meta}
+                    fidx.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    fidx.flush()
+                    with self._lock:
+                        self._used_bytes += len(data)
+                        self.stats["written"] += 1
+                except Exception as e:
+                    print("⚠️ Capture write error:", e)
+                    self._bump("write_errors")
+                finally:
+                    with self._lock:
+                        self._pending_bytes -= reserved
+        finally:
+            fbin.close(); fidx.close()
+
+# ====== Đọc lại shard ======
+def iter_records(capture_dir):
+    """Yield (meta, bytes) theo thứ tự shard / offset."""
+    for sid in _list_shards(capture_dir):
+        bin_path, idx_path = _shard_paths(capture_dir, sid)
+        if not os.path.exists(idx_path):
+            continue
+        with open(bin_path, "rb") as fbin, open(idx_path, "r", encoding="utf-8") as fidx:
+            for line in fidx:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # dòng cuối bị ghi dở
+                fbin.seek(rec["offset"])
+                data = fbin.read(rec["length"])
+                if len(data) == rec["length"]:
+                    yield rec, data
+
+def decode_record(rec, data):
+    """Bản ghi raw RGB (fast path 224x224) → PNG bytes; ảnh đã encode giữ nguyên."""
+    if rec.get("format") != "rgb8":
+        return data
+    import io
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.frombytes("RGB", (int(rec["width"]), int(rec["height"])), data).save(buf, format="PNG")
+    return buf.getvalue()
+
+def export_imagefolder(capture_dir, output_dir, split="train", label_key="pred_class",
+                       reasons=("low_confidence",)):
+    """
+    Ghi ra <output_dir>/<split>/<label>/<sha1>.<ext>.
+    Nhãn mặc định là lớp model dự đoán (nhãn tạm để người gán nhãn sửa lại).
+    Mặc định chỉ lấy bản ghi reason="low_confidence" (CAPTURE_MODE=all còn ghi cả "traffic");
+    bản ghi cũ không có reason được coi là low_confidence. reasons=None → lấy tất cả.
+    Ảnh trùng (cùng sha1) chỉ ghi một lần.
+    """
+    counts = {}
+    for rec, data in iter_records(capture_dir):
+        if reasons is not None and rec.get("reason", "low_confidence") not in reasons:
+            continue
+        data = decode_record(rec, data)
+        label = str(rec.get(label_key) or "unlabeled")
+        dst_dir = os.path.join(output_dir, split, label)
+        os.makedirs(dst_dir, exist_ok=True)
+        dst = os.path.join(dst_dir, rec["sha1"] + _guess_ext(data))
+        if os.path.exists(dst):
+            continue
+        with open(dst, "wb") as f:
+            f.write(data)
+        counts[label] = counts.get(label, 0) + 1
+    print(f"✅ Exported {sum(counts.values())} ảnh → {os.path.join(output_dir, split)}")
+    for k, v in sorted(counts.items()):
+        print(f"  {k}: {v}")
+    return counts
+
+def _main():
+    ap = argparse.ArgumentParser(description="Capture shards → ImageFolder")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("export")
+    e.add_argument("--src", default=os.getenv("CAPTURE_DIR", "captures"))
+    e.add_argument("--out", required=True)
+    e.add_argument("--split", default="train")
+    e.add_argument("--label-key", default="pred_class")
+    e.add_argument("--reason", choices=["low_confidence", "traffic", "all"], default="low_confidence")
+    args = ap.parse_args()
+    reasons = None if args.reason == "all" else (args.reason,)
+    export_imagefolder(args.src, args.out, args.split, args.label_key, reasons)
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,93 @@
+# model_loader.py
+"""
+Dựng VGG16 + đọc classes.json / checkpoint — dùng chung cho server (app.py)
+và các công cụ offline (similarity.py, replay.py).
+"""
+import os, json
+
+import torch
+import torch.nn as nn
+from torchvision import models
+from torchvision.models import VGG16_Weights
+
+# ====== Load classes.json (hỗ trợ nhiều format) ======
+def load_class_names(classes_json, default=("bad_fruit","good_fruit")):
+    """
+    Hỗ trợ:
+    1) {"classes": ["bad_fruit","good_fruit"]}
+    2) ["bad_fruit","good_fruit"]
+    3) {"0":"bad_fruit","1":"good_fruit"} (mapping index->name)
+    """
+    try:
+        with open(classes_json, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if isinstance(data, dict) and "classes" in data and isinstance(data["classes"], list):
+            classes = data["classes"]
+        elif isinstance(data, list):
+            classes = data
+        elif isinstance(data, dict):  # mapping index->name
+            try:
+                keys = sorted(data.keys(), key=lambda k: int(k))
+            except Exception:
+                keys = sorted(data.keys())
+            classes = [data[k] for k in keys]
+        else:
+            raise ValueError("Định dạng classes.json không hợp lệ.")
+
+        if not isinstance(classes, list) or len(classes) < 2:
+            raise ValueError("Danh sách lớp không hợp lệ.")
+        return classes
+
+    except Exception as e:
+        print(f"⚠️ Không đọc được classes.json, dùng mặc định: {e}")
+        return list(default)
+
+# ====== Build & Load model ======
+def build_model(num_classes: int, pretrained: bool = True) -> torch.nn.Module:
+    """pretrained=False: không tải weights ImageNet (checkpoint sẽ ghi đè toàn bộ) → chạy offline được."""
+    model = models.vgg16(weights=VGG16_Weights.DEFAULT if pretrained else None)
+    for p in model.features.parameters():
+        p.requires_grad = False
+    model.classifier[6] = nn.Linear(4096, num_classes)
+    return model
+
+def _extract_state_dict(state):
+    """
+    Trả về state_dict thuần từ nhiều kiểu checkpoint:
+    - state là dict các weights
+    - state có key 'state_dict' hoặc 'model_state_dict'
+    - keys có prefix '_orig_mod.' (khi dùng torch.compile) -> strip
+    """
+    if isinstance(state, dict):
+        if "model_state_dict" in state and isinstance(state["model_state_dict"], dict):
+            state = state["model_state_dict"]
+        elif "state_dict" in state and isinstance(state["state_dict"], dict):
+            state = state["state_dict"]
+
+    if isinstance(state, dict) and all(isinstance(k, str) for k in state.keys()):
+        if any(k.startswith("_orig_mod.") for k in state.keys()):
+            state = {k.replace("_orig_mod.", ""): v for k, v in state.items()}
+    return state
+
+def load_model(model_path, num_classes, pretrained=True):
+    try:
+        print("🔄 Loading VGG16...")
+        model = build_model(num_classes, pretrained=pretrained)
+        if os.path.exists(model_path):
+            raw = torch.load(model_path, map_location="cpu")
+            state = _extract_state_dict(raw)
+            try:
+                model.load_state_dict(state, strict=True)
+            except Exception as e:
+                print(f"⚠️ strict=True fail: {e} → thử strict=False")
+                model.load_state_dict(state, strict=False)
+            print(f"✅ Loaded weights: {model_path}")
+        else:
+            print(f"⚠️ Không tìm thấy model tại: {model_path} (hãy train trước)")
+
+        model.eval()
+        return model
+    except Exception as e:
+        print("❌ Lỗi load model:", e)
+        return None
@@ -0,0 +1,162 @@
+# optimize.py
+"""
+Chế độ suy luận CPU tối ưu cho /predict (chọn bằng INFERENCE_MODE):
+  - eager       : model gốc (mặc định)
+  - torchscript : channels_last → trace → freeze → optimize_for_inference (fold/fuse conv+ReLU)
+  - compile     : channels_last → torch.compile (Inductor, FX graph cache trên đĩa)
+
+Artifact được cache trong OPT_CACHE_DIR (khóa = checkpoint + phiên bản torch) nên lần khởi động
+sau không phải compile lại. Khi khởi động, output của model tối ưu được so với eager;
+lệch quá ngưỡng → tự quay về eager.
+Model eager vẫn được giữ (cho /embed và làm tham chiếu) → chế độ tối ưu giữ thêm một bản weights.
+
+Đo latency theo batch size:
+    python optimize.py --mode torchscript --batch-sizes 1 4 8 16
+"""
+import os, copy, time, hashlib, argparse
+
+import torch
+
+MODES = ("eager", "torchscript", "compile")
+
+def _cache_key(model_path, num_classes):
+    st = os.stat(model_path) if model_path and os.path.exists(model_path) else None
+    raw = f"{model_path}|{st.st_size if st else 0}|{st.st_mtime_ns if st else 0}|{num_classes}|{torch.__version__}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def _example(batch_size=1, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return torch.randn(batch_size, 3, 224, 224, generator=g)
+
+def _to_channels_last(x):
+    return x.contiguous(memory_format=torch.channels_last)
+
+def _build_torchscript(model, cache_path):
+    """
+    Cache bản đã freeze (chưa optimize_for_inference): bản optimize có thể chứa op MKLDNN
+    gắn với máy build, nên bước optimize luôn chạy lại sau khi load.
+    Lỗi ghi cache chỉ log, không làm hỏng model đã build.
+    """
+    if os.path.exists(cache_path):
+        print(f"📦 TorchScript cache: {cache_path}")
+        frozen = torch.jit.load(cache_path, map_location="cpu")
+    else:
+        print("⚙️ Tracing + freezing TorchScript...")
+        with torch.no_grad():
+            traced = torch.jit.trace(model, _to_channels_last(_example()))
+            frozen = torch.jit.freeze(traced.eval())
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            torch.jit.save(frozen, cache_path)
+            print(f"💾 Saved TorchScript: {cache_path}")
+        except Exception as e:
+            print(f"⚠️ Không ghi được cache TorchScript ({cache_path}): {e}")
+    return torch.jit.optimize_for_inference(frozen)
+
+def _build_compiled(model, cache_dir):
+    # Inductor đọc các biến này khi compile → cache graph/kernels trên đĩa
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except Exception:
+        pass
+    compiled = torch.compile(model, dynamic=False)
+    with torch.inference_mode():
+        compiled(_to_channels_last(_example()))  # compile ngay lúc khởi động, không phải ở request đầu
+    return compiled
+
+def check_equivalence(reference, optimized, batch_size=2, atol=1e-3, rtol=1e-3):
+    """So logits eager vs optimized trên input ngẫu nhiên cố định."""
+    x = _example(batch_size, seed=123)
+    with torch.inference_mode():
+        ref = reference(x)
+        out = optimized(_to_channels_last(x))
+    max_diff = float((ref - out).abs().max())
+    same_argmax = bool((ref.argmax(1) == out.argmax(1)).all())
+    ok = same_argmax and torch.allclose(ref, out, atol=atol, rtol=rtol)
+    return ok, max_diff
+
+def benchmark(fn, batch_sizes=(1, 4, 8), repeats=10):
+    """→ {batch_size: ms/batch} (median)."""
+    out = {}
+    for bs in batch_sizes:
+        x = _example(bs)
+        times = []
+        with torch.inference_mode():
+            fn(x)  # warmup
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                fn(x)
+                times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+        out[bs] = round(times[len(times) // 2], 2)
+    return out
+
+def optimize_model(model, mode="eager", cache_dir="model/.cache", model_path=None,
+                   num_classes=2, atol=1e-3):
+    """
+    return: (callable, info). callable nhận tensor (B,3,224,224); đầu vào được chuyển
+    channels_last bên trong nên caller không cần biết chế độ nào đang chạy.
+    """
+    info = {"mode": "eager", "requested": mode}
+    if mode not in MODES:
+        print(f"⚠️ INFERENCE_MODE không hợp lệ: {mode} → eager")
+        return model, info
+    if mode == "eager":
+        return model, info
+
+    # Model eager (layout mặc định) dùng làm tham chiếu; bản tối ưu là bản sao channels_last
+    opt_src = copy.deepcopy(model).eval().to(memory_format=torch.channels_last)
+    try:
+        t0 = time.time()
+        if mode == "torchscript":
+            path = os.path.join(cache_dir, f"vgg16_{_cache_key(model_path, num_classes)}.frozen.pt")
+            graph = _build_torchscript(opt_src, path)
+        else:
+            graph = _build_compiled(opt_src, cache_dir)
+        build_s = round(time.time() - t0, 2)
+    except Exception as e:
+        print(f"❌ Không build được {mode}: {e} → eager")
+        return model, dict(info, error=str(e))
+
+    ok, max_diff = check_equivalence(model, graph, atol=atol, rtol=atol)
+    info.update(equivalent=ok, max_abs_diff=max_diff, build_s=build_s)  # không round: thường ~1e-8
+    if not ok:
+        print(f"⚠️ {mode} lệch eager (max |Δ| = {max_diff:.2e}) → eager")
+        return model, info
+
+    def run(x):
+        return graph(_to_channels_last(x))
+
+    info["mode"] = mode
+    print(f"⚡ Inference mode: {mode} (build {build_s}s, max |Δ| = {max_diff:.2e})")
+    return run, info
+
+def _main():
+    ap = argparse.ArgumentParser(description="Latency eager vs optimized theo batch size")
+    ap.add_argument("--mode", choices=MODES[1:], default="torchscript")
+    ap.add_argument("--model-path", default=os.getenv("MODEL_PATH", "model/vgg16_fruit_model_2cls.pth"))
+    ap.add_argument("--classes-json", default=os.getenv("CLASSES_JSON", "model/classes.json"))
+    ap.add_argument("--cache-dir", default=os.getenv("OPT_CACHE_DIR", "model/.cache"))
+    ap.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    ap.add_argument("--repeats", type=int, default=10)
+    ap.add_argument("--threads", type=int, default=0)
+    args = ap.parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    from model_loader import load_class_names, load_model
+    num_classes = len(load_class_names(args.classes_json))
+    model = load_model(args.model_path, num_classes, pretrained=False)
+    fn, info = optimize_model(model, args.mode, args.cache_dir, args.model_path, num_classes)
+
+    eager_ms = benchmark(model, args.batch_sizes, args.repeats)
+    opt_ms = benchmark(fn, args.batch_sizes, args.repeats)
+    print(f"\n{'batch':>5} {'eager ms':>10} {info['mode'] + ' ms':>16} {'speedup':>8}")
+    for bs in args.batch_sizes:
+        print(f"{bs:>5} {eager_ms[bs]:>10.2f} {opt_ms[bs]:>16.2f} {eager_ms[bs] / opt_ms[bs]:>7.2f}x")
+
+if __name__ == "__main__":
+    _main()
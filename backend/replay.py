@@ -0,0 +1,203 @@
+# replay.py
+"""
+Shadow-test checkpoint mới trên traffic thật trước khi thay model đang chạy.
+
+Nguồn input (chạy offline hoàn toàn, không gọi server):
+  - --capture-dir : shard ghi bởi server (CAPTURE_DIR + CAPTURE_MODE=all), đã bỏ EXIF/GPS;
+                    lấy mọi reason ("traffic" + "low_confidence") để giữ đúng phân phối request
+  - --corpus      : thư mục ảnh bất kỳ (duyệt đệ quy)
+
+Mỗi model (current / candidate) được load bằng model_loader.load_model và tiền xử lý bằng
+utils.process_image / process_raw_rgb — đúng code path của /predict — rồi replay với
+tốc độ (--rate req/s, 0 = nhanh nhất có thể) và số luồng đồng thời (--concurrency) cấu hình được.
+
+Báo cáo: tỉ lệ đồng thuận dự đoán, ma trận chuyển lớp, dịch chuyển độ tin cậy,
+phân phối latency (p50/p90/p99) của từng model và chênh lệch.
+
+    python replay.py --current model/vgg16_fruit_model_2cls.pth --candidate new.pth \\
+                     --capture-dir captures --rate 20 --concurrency 4 --out replay_report.json
+"""
+import os, json, time, argparse, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from utils import process_image, process_raw_rgb
+from model_loader import load_class_names, load_model
+from capture import iter_records
+from optimize import optimize_model, MODES
+
+IMG_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# ====== Input ======
+def load_inputs(capture_dir=None, corpus=None, limit=None):
+    """→ list[(record_meta, bytes)]; record_meta["format"] == "rgb8" cho fast path."""
+    inputs = []
+    if capture_dir:
+        for rec, data in iter_records(capture_dir):
+            inputs.append(({"format": rec.get("format", "encoded"),
+                            "width": rec.get("width"), "height": rec.get("height")}, data))
+            if limit and len(inputs) >= limit:
+                return inputs
+    if corpus:
+        for root, _, files in sorted(os.walk(corpus)):
+            for f in sorted(files):
+                if f.lower().endswith(IMG_EXTS):
+                    with open(os.path.join(root, f), "rb") as fh:
+                        inputs.append(({"format": "encoded"}, fh.read()))
+                    if limit and len(inputs) >= limit:
+                        return inputs
+    return inputs
+
+def preprocess(meta, data):
+    if meta.get("format") == "rgb8":
+        return process_raw_rgb(data, int(meta["width"]), int(meta["height"]))
+    return process_image(data)
+
+# ====== Replay ======
+def replay(model, inputs, rate=0.0, concurrency=1):
+    """
+    Open-loop: request i được lên lịch tại t0 + i/rate (rate=0 → gửi ngay).
+    latency_ms = thời gian xử lý (preprocess + forward); queue_ms = trễ so với lịch.
+    """
+    n = len(inputs)
+    preds = np.zeros(n, dtype=np.int64)
+    probs = [None] * n
+    latency = np.zeros(n, dtype=np.float64)
+    queue_ms = np.zeros(n, dtype=np.float64)
+    errors = []
+    lock = threading.Lock()
+    t_start = time.perf_counter() + 0.05
+
+    def run(i):
+        scheduled = t_start + (i / rate if rate > 0 else 0.0)
+        wait = scheduled - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        t0 = time.perf_counter()
+        try:
+            x = preprocess(*inputs[i])
+            with torch.inference_mode():
+                p = torch.softmax(model(x)[0], dim=0)
+            preds[i] = int(p.argmax())
+            probs[i] = p.numpy()
+        except Exception as e:
+            with lock:
+                errors.append((i, str(e)))
+            preds[i] = -1
+        t1 = time.perf_counter()
+        latency[i] = (t1 - t0) * 1000
+        queue_ms[i] = max(0.0, (t0 - scheduled) * 1000)
+
+    wall0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        list(pool.map(run, range(n)))
+    wall = time.perf_counter() - wall0
+    return {"preds": preds, "probs": probs, "latency_ms": latency,
+            "queue_ms": queue_ms, "errors": errors, "wall_s": wall}
+
+def _latency_stats(ms):
+    if len(ms) == 0:
+        return {}
+    return {"mean": round(float(np.mean(ms)), 2),
+            **{f"p{q}": round(float(np.percentile(ms, q)), 2) for q in (50, 90, 99)},
+            "max": round(float(np.max(ms)), 2)}
+
+# ====== Report ======
+def compare(cur, cand, class_names, threshold_pct):
+    ok = (cur["preds"] >= 0) & (cand["preds"] >= 0)
+    idx = np.flatnonzero(ok)
+    n = len(idx)
+    agree = cur["preds"][idx] == cand["preds"][idx]
+
+    # Ma trận chuyển lớp current → candidate
+    C = len(class_names)
+    flips = np.zeros((C, C), dtype=np.int64)
+    np.add.at(flips, (cur["preds"][idx], cand["preds"][idx]), 1)
+
+    # Độ tin cậy: top-1 của mỗi model, và prob của candidate trên lớp current đã chọn
+    cur_top = np.array([cur["probs"][i].max() for i in idx]) * 100
+    cand_top = np.array([cand["probs"][i].max() for i in idx]) * 100
+    cand_on_cur = np.array([cand["probs"][i][cur["preds"][i]] for i in idx]) * 100
+    shift = cand_on_cur - cur_top
+
+    def lat(r):
+        return {"latency_ms": _latency_stats(r["latency_ms"][idx]),
+                "queue_ms": _latency_stats(r["queue_ms"][idx]),
+                "throughput_rps": round(len(r["preds"]) / max(r["wall_s"], 1e-9), 2),
+                "errors": len(r["errors"])}
+
+    cur_lat, cand_lat = lat(cur), lat(cand)
+    return {
+        "n": int(n),
+        "agreement_rate": round(float(agree.mean()), 4) if n else None,
+        "transitions": {f"{class_names[a]}→{class_names[b]}": int(flips[a, b])
+                        for a in range(C) for b in range(C) if flips[a, b]},
+        "confidence": {
+            "current_top1_mean_pct": round(float(cur_top.mean()), 2) if n else None,
+            "candidate_top1_mean_pct": round(float(cand_top.mean()), 2) if n else None,
+            "shift_on_current_pred_mean_pct": round(float(shift.mean()), 2) if n else None,
+            "shift_on_current_pred_abs_mean_pct": round(float(np.abs(shift).mean()), 2) if n else None,
+            "current_below_threshold": round(float((cur_top < threshold_pct).mean()), 4) if n else None,
+            "candidate_below_threshold": round(float((cand_top < threshold_pct).mean()), 4) if n else None,
+        },
+        "current": cur_lat,
+        "candidate": cand_lat,
+        "latency_delta_ms": {k: round(cand_lat["latency_ms"][k] - cur_lat["latency_ms"][k], 2)
+                             for k in cur_lat["latency_ms"]},
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay traffic: current vs candidate checkpoint")
+    ap.add_argument("--current", default=os.getenv("MODEL_PATH", "model/vgg16_fruit_model_2cls.pth"))
+    ap.add_argument("--candidate", required=True)
+    ap.add_argument("--classes-json", default=os.getenv("CLASSES_JSON", "model/classes.json"))
+    ap.add_argument("--capture-dir", default=None)
+    ap.add_argument("--corpus", default=None)
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--rate", type=float, default=0.0, help="req/s, 0 = không giới hạn")
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--threads", type=int, default=0, help="torch threads (0 = mặc định)")
+    ap.add_argument("--inference-mode", choices=MODES, default=os.getenv("INFERENCE_MODE", "eager"))
+    ap.add_argument("--cache-dir", default=os.getenv("OPT_CACHE_DIR", "model/.cache"))
+    ap.add_argument("--threshold", type=float, default=float(os.getenv("DEFAULT_THRESHOLD", "70.0")))
+    ap.add_argument("--out", default="replay_report.json")
+    args = ap.parse_args()
+    assert args.capture_dir or args.corpus, "Cần --capture-dir hoặc --corpus"
+    for p in (args.current, args.candidate):
+        assert os.path.exists(p), f"Không tìm thấy checkpoint: {p}"
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    class_names = load_class_names(args.classes_json)
+    inputs = load_inputs(args.capture_dir, args.corpus, args.limit)
+    assert inputs, "Không có input để replay"
+    print(f"📼 {len(inputs)} input | rate {args.rate or '∞'} req/s | concurrency {args.concurrency}")
+
+    results = {}
+    for name, path in (("current", args.current), ("candidate", args.candidate)):
+        # pretrained=False: checkpoint ghi đè toàn bộ weights → không cần mạng
+        model = load_model(path, len(class_names), pretrained=False)
+        assert model is not None, f"Load model lỗi: {path}"
+        model, _ = optimize_model(model, args.inference_mode, args.cache_dir, path, len(class_names))
+        replay(model, inputs[:min(5, len(inputs))])  # warmup
+        results[name] = replay(model, inputs, args.rate, args.concurrency)
+        lat = _latency_stats(results[name]["latency_ms"])
+        print(f"▶️ {name:9s} p50 {lat['p50']} ms | p99 {lat['p99']} ms | errors {len(results[name]['errors'])}")
+        del model
+
+    report = compare(results["current"], results["candidate"], class_names, args.threshold)
+    report.update(current_path=args.current, candidate_path=args.candidate,
+                  rate=args.rate, concurrency=args.concurrency, inference_mode=args.inference_mode)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n🤝 Agreement: {report['agreement_rate']} ({report['n']} mẫu)")
+    print(f"🔀 Transitions: {report['transitions']}")
+    print(f"📈 Confidence: {report['confidence']}")
+    print(f"⏱️ Latency Δ (candidate - current): {report['latency_delta_ms']}")
+    print(f"✅ Report saved: {args.out}")
+
+if __name__ == "__main__":
+    main()
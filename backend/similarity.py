@@ -0,0 +1,257 @@
+# similarity.py
+"""
+Embedding 4096-d (lớp áp chót của VGG16) + chỉ mục tương đồng trong bộ nhớ.
+
+Gallery được build offline từ một split ImageFolder:
+    <out_dir>/embeddings.npy   ma trận (N, 4096) đã L2-normalize, liên tục (fp16/fp32)
+    <out_dir>/meta.json        {"dim", "dtype", "count", "classes", "items": [{"path","label"}]}
+
+CLI:
+    python similarity.py build --root <imagefolder/train> --out model/gallery [--fp16]
+    python similarity.py bench --n 100000 [--fp16]
+"""
+import os, json, time, argparse
+
+import numpy as np
+import torch
+
+EMBED_DIM = 4096
+
+# ====== Embedding ======
+def extract_embedding(model: torch.nn.Module, x: torch.Tensor) -> torch.Tensor:
+    """
+    x: tensor (B,3,224,224) đã normalize → (B,4096)
+    Chạy features → avgpool → classifier[:6] (bỏ Linear cuối), giống hệt forward của VGG16.
+    """
+    f = model.features(x)
+    f = model.avgpool(f)
+    f = torch.flatten(f, 1)
+    return model.classifier[:6](f)
+
+def l2_normalize(x: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norm, eps)
+
+# ====== Gallery index ======
+class GalleryIndex:
+    """
+    Ma trận embedding (N, D) đã chuẩn hóa L2 → cosine = tích vô hướng.
+    Query theo batch: scores = G @ Q.T, quét theo từng chunk (8192 dòng ≈ 64 MiB fp16).
+    Gallery fp16: nhân trực tiếp bằng torch ở fp16 (không ép cả chunk lên fp32, vốn chậm hơn
+    cả phép nhân), giữ một nhóm ứng viên rồi tính lại điểm chính xác ở fp32 trước khi lấy top-k.
+    """
+
+    def __init__(self, embeddings: np.ndarray, items, classes=None, chunk_size: int = 8192):
+        assert embeddings.ndim == 2, "embeddings phải có shape (N, D)"
+        self.embeddings = embeddings
+        self.items = list(items)
+        self.classes = list(classes or [])
+        self.chunk_size = int(chunk_size)
+        self._half_mm = embeddings.dtype == np.float16  # torch cũ không có matmul fp16 trên CPU → tắt khi lỗi
+        assert len(self.items) == embeddings.shape[0], "Số item không khớp số embedding"
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1]
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True, **kwargs):
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # "c" (copy-on-write): không bao giờ ghi, nhưng mảng writable → torch.from_numpy không phải copy chunk
+        emb = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="c" if mmap else None)
+        return cls(emb, meta.get("items", []), meta.get("classes"), **kwargs)
+
+    def search(self, queries: np.ndarray, k: int = 5):
+        """
+        queries: (B, D) chưa/đã chuẩn hóa đều được.
+        return: (scores (B,k), indices (B,k)) sắp xếp giảm dần.
+        """
+        q = l2_normalize(np.atleast_2d(queries))
+        n = len(self)
+        k = max(1, min(int(k), n))
+        approx = self.embeddings.dtype != np.float32
+        pool = min(n, max(4 * k, 32)) if approx else k   # điểm fp16 lệch ~1e-3 → lấy dư rồi chấm lại
+        best_s = np.full((q.shape[0], 0), -np.inf, dtype=np.float32)
+        best_i = np.zeros((q.shape[0], 0), dtype=np.int64)
+        qh = torch.from_numpy(q.T.astype(np.float16)) if self._half_mm else None
+
+        for start in range(0, n, self.chunk_size):
+            s = self._chunk_scores(self.embeddings[start:start + self.chunk_size], q, qh).T  # (B, chunk)
+            kk = min(pool, s.shape[1])
+            idx = np.argpartition(-s, kk - 1, axis=1)[:, :kk]
+            cand_s = np.take_along_axis(s, idx, axis=1)
+            best_s = np.concatenate([best_s, cand_s], axis=1)
+            best_i = np.concatenate([best_i, idx + start], axis=1)
+            if best_s.shape[1] > pool:
+                keep = np.argpartition(-best_s, pool - 1, axis=1)[:, :pool]
+                best_s = np.take_along_axis(best_s, keep, axis=1)
+                best_i = np.take_along_axis(best_i, keep, axis=1)
+
+        if approx:
+            best_s, best_i = self._rescore(q, best_i, k)
+        order = np.argsort(-best_s, axis=1)
+        return np.take_along_axis(best_s, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+    def _chunk_scores(self, block, q, qh):
+        """(chunk, D) @ (D, B) → (chunk, B) fp32."""
+        if qh is not None and self._half_mm:
+            try:
+                block = block if block.flags.writeable else np.array(block)
+                return (torch.from_numpy(block) @ qh).float().numpy()
+            except RuntimeError:
+                self._half_mm = False
+        return np.asarray(block, dtype=np.float32) @ q.T
+
+    def _rescore(self, q, cand_i, k):
+        """Điểm fp32 chính xác cho nhóm ứng viên (B, pool) → top-k."""
+        out_s = np.empty((q.shape[0], k), dtype=np.float32)
+        out_i = np.empty((q.shape[0], k), dtype=np.int64)
+        for b in range(q.shape[0]):
+            idx = np.sort(cand_i[b])
+            exact = np.asarray(self.embeddings[idx], dtype=np.float32) @ q[b]
+            top = np.argpartition(-exact, k - 1)[:k]
+            out_s[b], out_i[b] = exact[top], idx[top]
+        return out_s, out_i
+
+    def lookup(self, queries: np.ndarray, k: int = 5):
+        """Như search() nhưng trả về list kết quả có path/label cho từng query."""
+        scores, indices = self.search(queries, k)
+        out = []
+        for row_s, row_i in zip(scores, indices):
+            out.append([
+                {"rank": r + 1, "score": round(float(s), 6), **self.items[int(i)]}
+                for r, (s, i) in enumerate(zip(row_s, row_i))
+            ])
+        return out
+
+# ====== Build offline ======
+def build_gallery(model, root: str, out_dir: str, batch_size: int = 64,
+                  num_workers: int = 2, fp16: bool = False, device: str = "cpu"):
+    """
+    Duyệt ImageFolder `root`, tính embedding và ghi thẳng vào embeddings.npy
+    (open_memmap → không cần giữ toàn bộ ma trận trong RAM).
+    """
+    from torchvision import datasets
+    from torch.utils.data import DataLoader
+    from utils import BASE_TRANSFORM
+
+    ds = datasets.ImageFolder(root, transform=BASE_TRANSFORM)
+    loader = DataLoader(ds, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    os.makedirs(out_dir, exist_ok=True)
+
+    dtype = np.float16 if fp16 else np.float32
+    emb = np.lib.format.open_memmap(os.path.join(out_dir, "embeddings.npy"),
+                                    mode="w+", dtype=dtype, shape=(len(ds), EMBED_DIM))
+    model = model.to(device).eval()
+    pos = 0
+    t0 = time.time()
+    with torch.inference_mode():
+        for x, _ in loader:
+            e = extract_embedding(model, x.to(device)).float().cpu().numpy()
+            emb[pos:pos + len(e)] = l2_normalize(e).astype(dtype)
+            pos += len(e)
+    emb.flush()
+    del emb
+
+    items = [
+        {"path": os.path.relpath(p, root), "label": ds.classes[y]}
+        for p, y in ds.samples
+    ]
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "dim": EMBED_DIM,
+            "dtype": np.dtype(dtype).name,
+            "count": len(ds),
+            "classes": ds.classes,
+            "items": items
+        }, f, ensure_ascii=False)
+
+    dt = time.time() - t0
+    print(f"✅ Gallery: {len(ds)} ảnh → {out_dir} ({dt:.1f}s, {len(ds)/max(dt,1e-9):.1f} img/s)")
+    return out_dir
+
+# ====== Benchmark ======
+def bench(n: int = 100_000, dim: int = EMBED_DIM, fp16: bool = False,
+          batch_sizes=(1, 8, 32), k: int = 5, repeats: int = 5, seed: int = 0, out_dir=None):
+    """
+    Đo build + query trên gallery ngẫu nhiên, đi đúng đường của build thật / server:
+    ghi embeddings.npy bằng open_memmap + meta.json, rồi GalleryIndex.load(mmap=True).search.
+    out_dir=None → thư mục tạm, xóa sau khi đo.
+    """
+    import shutil, tempfile
+    rng = np.random.default_rng(seed)
+    dtype = np.float16 if fp16 else np.float32
+    tmp = out_dir is None
+    out_dir = tempfile.mkdtemp(prefix="gallery_bench_") if tmp else out_dir
+    os.makedirs(out_dir, exist_ok=True)
+
+    try:
+        t0 = time.perf_counter()
+        emb = np.lib.format.open_memmap(os.path.join(out_dir, "embeddings.npy"),
+                                        mode="w+", dtype=dtype, shape=(n, dim))
+        step = 8192
+        for s in range(0, n, step):
+            block = rng.standard_normal((min(step, n - s), dim), dtype=np.float32)
+            emb[s:s + len(block)] = l2_normalize(block).astype(dtype)
+        emb.flush()
+        nbytes = emb.nbytes
+        del emb
+        with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "dtype": np.dtype(dtype).name, "count": n, "classes": [],
+                       "items": [{"path": str(i), "label": ""} for i in range(n)]}, f)
+        build_s = time.perf_counter() - t0
+        print(f"📦 Build {n} x {dim} ({np.dtype(dtype).name}, {nbytes/2**20:.0f} MiB, open_memmap): "
+              f"{build_s:.2f}s → {n/build_s:,.0f} vec/s")
+
+        t0 = time.perf_counter()
+        index = GalleryIndex.load(out_dir, mmap=True)
+        print(f"📂 Load (mmap): {(time.perf_counter() - t0)*1000:.1f} ms")
+        for bs in batch_sizes:
+            q = rng.standard_normal((bs, dim), dtype=np.float32)
+            index.search(q, k)  # warmup (page-in từ file)
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                index.search(q, k)
+            dt = (time.perf_counter() - t0) / repeats
+            print(f"🔎 Query batch={bs:3d} top{k}: {dt*1000:8.2f} ms/batch → {bs/dt:,.1f} query/s")
+        del index
+    finally:
+        if tmp:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+def _main():
+    ap = argparse.ArgumentParser(description="Gallery index cho embedding VGG16")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Build gallery từ ImageFolder")
+    b.add_argument("--root", required=True)
+    b.add_argument("--out", default=os.getenv("GALLERY_DIR", "model/gallery"))
+    b.add_argument("--batch-size", type=int, default=64)
+    b.add_argument("--num-workers", type=int, default=2)
+    b.add_argument("--fp16", action="store_true")
+    b.add_argument("--model-path", default=os.getenv("MODEL_PATH", "model/vgg16_fruit_model_2cls.pth"))
+    b.add_argument("--classes-json", default=os.getenv("CLASSES_JSON", "model/classes.json"))
+
+    s = sub.add_parser("bench", help="Benchmark build/query với dữ liệu ngẫu nhiên")
+    s.add_argument("--n", type=int, default=100_000)
+    s.add_argument("--fp16", action="store_true")
+    s.add_argument("--k", type=int, default=5)
+    s.add_argument("--dir", default=None, help="giữ file bench tại đây (mặc định: thư mục tạm)")
+
+    args = ap.parse_args()
+    if args.cmd == "build":
+        from model_loader import load_class_names, load_model  # cùng code load với server
+        model = load_model(args.model_path, len(load_class_names(args.classes_json)))
+        assert model is not None, "Model chưa load được"
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        build_gallery(model, args.root, args.out, args.batch_size, args.num_workers, args.fp16, device)
+    else:
+        bench(args.n, fp16=args.fp16, k=args.k, out_dir=args.dir)
+
+if __name__ == "__main__":
+    _main()
@@ -13,6 +13,16 @@ BASE_TRANSFORM = transforms.Compose([
     transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD),
 ])
 
+# Ảnh đã đúng 224x224 (client đã resize) → bỏ bước Resize
+NORMALIZE_TRANSFORM = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD),
+])
+
+# Fast path: client gửi thẳng pixel RGB uint8 (H*W*3 bytes, row-major) → bỏ decode + resize
+RAW_RGB_CONTENT_TYPE = "application/x-rgb8"
+INPUT_SIZE = 224
+
 def process_image(file_bytes, transform=BASE_TRANSFORM):
     """
     bytes → tensor shape (1,3,224,224)
@@ -20,8 +30,29 @@ def process_image(file_bytes, transform=BASE_TRANSFORM):
     img = Image.open(io.BytesIO(file_bytes))
     if img.mode != "RGB":
         img = img.convert("RGB")
+    if transform is BASE_TRANSFORM and img.size == (INPUT_SIZE, INPUT_SIZE):
+        transform = NORMALIZE_TRANSFORM
     return transform(img).unsqueeze(0)
 
+def process_raw_rgb(raw_bytes, width=INPUT_SIZE, height=INPUT_SIZE):
+    """
+    RGB uint8 bytes (H,W,3) → tensor shape (1,3,224,224), chỉ normalize
+    """
+    if (width, height) != (INPUT_SIZE, INPUT_SIZE):
+        raise ValueError(f"Raw RGB phải có kích thước {INPUT_SIZE}x{INPUT_SIZE}, nhận {width}x{height}")
+    if len(raw_bytes) != width * height * 3:
+        raise ValueError(f"Raw RGB cần {width * height * 3} bytes, nhận {len(raw_bytes)}")
+    x = torch.frombuffer(bytearray(raw_bytes), dtype=torch.uint8).view(height, width, 3)
+    x = x.permute(2, 0, 1).float().div_(255.0)
+    mean = torch.tensor(IMAGENET_MEAN).view(3, 1, 1)
+    std  = torch.tensor(IMAGENET_STD).view(3, 1, 1)
+    return ((x - mean) / std).unsqueeze(0)
+
+def image_size(file_bytes):
+    """Chỉ đọc header → (w, h), không decode toàn bộ ảnh."""
+    with Image.open(io.BytesIO(file_bytes)) as img:
+        return img.size
+
 def predict_class(output, class_names):
     """
     output: torch.Tensor shape [1, C]
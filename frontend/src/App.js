@@ -3,6 +3,46 @@ import "./App.css";
 import { motion, AnimatePresence } from "framer-motion";
 
 const API_URL = process.env.REACT_APP_API_URL || "http://127.0.0.1:5000";
+const INPUT_SIZE = 224;
+// Raw RGB (150 KB/ảnh) lớn hơn JPEG 224 nhiều lần → chỉ bật khi mạng nhanh, CPU server là nút cổ chai
+const RAW_RGB_UPLOAD = process.env.REACT_APP_RAW_RGB_UPLOAD === "1";
+
+// Vẽ nguồn (video/ảnh) vào canvas 224×224 → bỏ pixel thừa trước khi upload
+function drawToInput(canvas, source) {
+  canvas.width = INPUT_SIZE;
+  canvas.height = INPUT_SIZE;
+  const ctx = canvas.getContext("2d");
+  if (!ctx) return null;
+  ctx.drawImage(source, 0, 0, INPUT_SIZE, INPUT_SIZE);
+  return ctx;
+}
+
+// RGBA của canvas → RGB uint8 (H*W*3), đúng định dạng server đọc ở fast path
+function canvasToRgb(ctx) {
+  const { data } = ctx.getImageData(0, 0, INPUT_SIZE, INPUT_SIZE);
+  const rgb = new Uint8Array(INPUT_SIZE * INPUT_SIZE * 3);
+  for (let i = 0, j = 0; i < data.length; i += 4, j += 3) {
+    rgb[j] = data[i];
+    rgb[j + 1] = data[i + 1];
+    rgb[j + 2] = data[i + 2];
+  }
+  return rgb;
+}
+
+const canvasToBlob = (canvas, type, quality) =>
+  new Promise((resolve) => canvas.toBlob(resolve, type, quality));
+
+// Ảnh chọn từ máy → JPEG nhỏ 224×224 (server bỏ bước resize)
+async function downscaleToJpeg(file) {
+  const bitmap = await createImageBitmap(file);
+  const canvas = document.createElement("canvas");
+  drawToInput(canvas, bitmap);
+  const blob = await canvasToBlob(canvas, "image/jpeg", 0.9);
+  const meta = { orig_w: bitmap.width, orig_h: bitmap.height };
+  bitmap.close?.();
+  if (!blob) return null;
+  return { file: new File([blob], "upload_224.jpg", { type: "image/jpeg" }), meta };
+}
 
 function useDarkMode() {
   const prefersDark = window.matchMedia?.("(prefers-color-scheme: dark)")?.matches;
@@ -116,6 +156,8 @@ function App() {
   const [dark, setDark] = useDarkMode();
 
   const [image, setImage] = useState(null);
+  const [uploadMeta, setUploadMeta] = useState(null);   // {orig_w, orig_h} khi client đã resize
+  const [fastPath, setFastPath] = useState(null);       // server có hỗ trợ ảnh 224 / raw RGB?
   const [preview, setPreview] = useState(null);         // ảnh gốc (local)
   const [procPreview, setProcPreview] = useState(null); // ảnh 224x224 từ backend
   const [result, setResult] = useState("");
@@ -144,6 +186,14 @@ function App() {
     };
   }, [preview]);
 
+  // Hỏi server có fast path không; server cũ → gửi ảnh gốc như trước
+  useEffect(() => {
+    fetch(`${API_URL}/health`)
+      .then((r) => r.json())
+      .then((d) => setFastPath(d.fast_path || null))
+      .catch(() => setFastPath(null));
+  }, []);
+
   const showToast = (msg, t = 2500) => {
     setToast(msg);
     setTimeout(() => setToast(null), t);
@@ -151,14 +201,23 @@ function App() {
 
   const onPickFile = () => fileInputRef.current?.click();
 
-  const handleFile = (file) => {
+  const handleFile = async (file) => {
     if (!file) return;
     if (!file.type.startsWith("image/")) {
       showToast("File phải là ảnh (jpg/png/webp...)");
       return;
     }
+    let upload = null;
+    if (fastPath) {
+      try {
+        upload = await downscaleToJpeg(file);
+      } catch (err) {
+        console.warn("Resize phía client lỗi, gửi ảnh gốc:", err);
+      }
+    }
     if (preview) URL.revokeObjectURL(preview);
-    setImage(file);
+    setImage(upload?.file || file);
+    setUploadMeta(upload?.meta || null);
     setPreview(URL.createObjectURL(file));
     setProcPreview(null); // reset preview 224 khi chọn ảnh mới
     setResult("");
@@ -186,6 +245,14 @@ function App() {
 
     const formData = new FormData();
     formData.append("file", image);
+    if (uploadMeta) {
+      formData.append("orig_w", uploadMeta.orig_w);
+      formData.append("orig_h", uploadMeta.orig_h);
+    }
+    if (fastPath && image.type === fastPath.raw_rgb) {
+      formData.append("width", INPUT_SIZE);
+      formData.append("height", INPUT_SIZE);
+    }
 
     try {
       const res = await fetch(`${API_URL}/predict`, { method: "POST", body: formData });
@@ -245,30 +312,29 @@ function App() {
     setCameraOn(false);
   };
 
-  const captureImage = () => {
+  const captureImage = async () => {
     const video = videoRef.current;
     const canvas = canvasRef.current;
     if (!video || !canvas) return;
-    const ctx = canvas.getContext("2d");
+    const ctx = drawToInput(canvas, video);
     if (!ctx) return;
 
-    ctx.drawImage(video, 0, 0, 224, 224);
-    canvas.toBlob(
-      (blob) => {
-        if (blob) {
-          const file = new File([blob], "camera.jpg", { type: "image/jpeg" });
-          if (preview) URL.revokeObjectURL(preview);
-          setImage(file);
-          setPreview(URL.createObjectURL(file));
-          setProcPreview(null);
-          setResult("");
-          setScores(null);
-          setMeta(null);
-        }
-      },
-      "image/jpeg",
-      0.95
-    );
+    // Mặc định upload JPEG 224×224 (server bỏ resize); raw RGB chỉ khi bật REACT_APP_RAW_RGB_UPLOAD=1
+    const blob = await canvasToBlob(canvas, "image/jpeg", 0.95);
+    if (!blob) return;
+    const jpeg = new File([blob], "camera.jpg", { type: "image/jpeg" });
+    const file = RAW_RGB_UPLOAD && fastPath?.raw_rgb
+      ? new File([canvasToRgb(ctx)], "camera.rgb", { type: fastPath.raw_rgb })
+      : jpeg;
+
+    if (preview) URL.revokeObjectURL(preview);
+    setImage(file);
+    setUploadMeta({ orig_w: video.videoWidth, orig_h: video.videoHeight });
+    setPreview(URL.createObjectURL(jpeg));
+    setProcPreview(null);
+    setResult("");
+    setScores(null);
+    setMeta(null);
   };
 
   return (
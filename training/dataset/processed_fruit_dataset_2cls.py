@@ -11,7 +11,7 @@ Original file is located at
 # -*- coding: utf-8 -*-
 # ✅ ONE-CELL PIPELINE: build ImageFolder-ready dataset + PyTorch loaders (VGG16-ready)
 
-import os, sys, shutil, zipfile, random, json, warnings
+import os, sys, shutil, zipfile, tarfile, io, random, json, warnings
 warnings.filterwarnings("ignore")
 import numpy as np
 import pandas as pd
@@ -29,6 +29,10 @@ ZIP_PATH     = "/content/drive/MyDrive/Processed Images_Fruits.zip"
 EXTRACT_DIR  = "/content/Processed_Images_Fruits"     # chứa 3 thư mục: Bad Quality_Fruits / Good Quality_Fruits / Mixed Quality_Fruits
 OUTPUT_DIR   = "/content/drive/MyDrive/processed_fruit_dataset"  # đích ImageFolder
 MAKE_ZIP     = True                                   # tạo thêm file zip kết quả
+MAKE_SHARDS  = True                                   # tạo tar shard để train stream trực tiếp (không copy/giải nén)
+SHARD_DIR    = OUTPUT_DIR + "_shards"                 # <split>-00000.tar + shards.json
+SHARD_SIZE_MB = 256                                   # kích thước tối đa mỗi shard
+MIN_SHARDS   = 8                                      # tối thiểu số shard/split (≥ NUM_WORKERS khi train)
 CLASS_BY     = "quality"                               # 'quality' -> bad_fruit/good_fruit/mixed_fruit | 'label' -> theo loại quả
 SEED         = 42
 random.seed(SEED); np.random.seed(SEED)
@@ -191,7 +195,8 @@ def copy_images_to_folders(train_df, val_df=None, test_df=None, output_dir='proc
 
     if create_zip:
         zip_path = f"{output_dir}.zip"
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        # JPEG/PNG đã nén sẵn → ZIP_STORED (deflate chỉ tốn CPU, gần như không giảm dung lượng)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zf:
             for root, _, files in os.walk(output_dir):
                 for f in files:
                     fp = os.path.join(root, f)
@@ -200,6 +205,68 @@ def copy_images_to_folders(train_df, val_df=None, test_df=None, output_dir='proc
         return zip_path
     return None
 
+def write_tar_shards(imagefolder_dir, shard_dir, shard_size_mb=256, splits=('train','val','test'),
+                     min_shards=8):
+    """
+    ImageFolder → tar shard kích thước cố định cho mỗi split (không nén, đọc tuần tự).
+    Mỗi mẫu là 2 entry liền nhau: <key>.<ext> (bytes ảnh gốc) + <key>.json ({"label", "class"}).
+    Thứ tự mẫu được xáo trộn trước khi ghi để mỗi shard có đủ các lớp.
+    Shard được thu nhỏ khi cần để mỗi split có ít nhất min_shards shard (mỗi DataLoader worker một shard).
+    """
+    print("📦 Writing tar shards...")
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+    exts = ('.jpg','.jpeg','.png','.bmp','.webp')
+    rng = random.Random(SEED)
+    classes = sorted(d for d in os.listdir(os.path.join(imagefolder_dir, splits[0]))
+                     if os.path.isdir(os.path.join(imagefolder_dir, splits[0], d)))
+    manifest = {"classes": classes, "splits": {}}
+    max_bytes = int(shard_size_mb * 2**20)
+
+    def add_bytes(tf, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+
+    for split in splits:
+        split_dir = os.path.join(imagefolder_dir, split)
+        if not os.path.exists(split_dir):
+            continue
+        samples = [(os.path.join(split_dir, c, f), i)
+                   for i, c in enumerate(classes) if os.path.isdir(os.path.join(split_dir, c))
+                   for f in sorted(os.listdir(os.path.join(split_dir, c))) if f.lower().endswith(exts)]
+        rng.shuffle(samples)
+        total = sum(os.path.getsize(p) for p, _ in samples)
+        limit = min(max_bytes, max(1, -(-total // max(1, min_shards))))
+
+        shards, tf, size = [], None, 0
+        for k, (path, label) in enumerate(tqdm(samples, desc=f"Sharding {split}")):
+            with open(path, 'rb') as f:
+                data = f.read()
+            if tf is None or (size > 0 and size + len(data) > limit):
+                if tf is not None:
+                    tf.close()
+                name = f"{split}-{len(shards):05d}.tar"
+                shards.append(name)
+                tf, size = tarfile.open(os.path.join(shard_dir, name), 'w'), 0
+            key = f"{k:08d}"
+            ext = os.path.splitext(path)[1].lower()
+            add_bytes(tf, key + ext, data)
+            add_bytes(tf, key + ".json", json.dumps({"label": label, "class": classes[label]}).encode('utf-8'))
+            size += len(data)
+        if tf is not None:
+            tf.close()
+        manifest["splits"][split] = {"shards": shards, "count": len(samples)}
+        print(f"  {split}: {len(samples)} samples → {len(shards)} shards")
+        if 0 < len(shards) < min_shards:
+            print(f"⚠️ {split}: chỉ {len(shards)} shard < {min_shards} (quá ít mẫu) → worker sẽ chia theo mẫu")
+
+    with open(os.path.join(shard_dir, "shards.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print("✅ Shards written to:", shard_dir)
+    return shard_dir
+
 # ========= RUN PIPELINE =========
 paths = setup_data_paths(BASE_DIR)
 df = collect_image_data(paths)
@@ -218,6 +285,9 @@ zip_output = copy_images_to_folders(
 )
 print("🎉 DONE! Final zip saved at:", zip_output)
 
+if MAKE_SHARDS:
+    write_tar_shards(OUTPUT_DIR, SHARD_DIR, shard_size_mb=SHARD_SIZE_MB, min_shards=MIN_SHARDS)
+
 # ========= SHOW STRUCTURE SUMMARY =========
 def count_per_class(split_dir):
     d = {}
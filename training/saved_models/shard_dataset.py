@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""shard_dataset.py
+
+IterableDataset đọc tar shard do processed_fruit_dataset_2cls.py (write_tar_shards) tạo ra.
+
+- Đọc tuần tự từng shard (tarfile stream mode) từ local disk hoặc Drive mount → không copy/giải nén
+- Shuffle 2 tầng: xáo thứ tự shard mỗi epoch + shuffle buffer trong bộ nhớ
+- Chia việc cho DataLoader worker: đủ shard → worker i lấy shard i, i+W, ...;
+  ít shard hơn worker → mọi worker đọc mọi shard, worker i giữ mẫu thứ j với j % W == i
+- Epoch lưu trong mp.Value dùng chung → set_epoch() ở process chính có hiệu lực
+  cả với persistent_workers=True (worker không được pickle lại mỗi epoch)
+
+Cấu trúc:
+    <shard_dir>/shards.json         {"classes": [...], "splits": {"train": {"shards": [...], "count": N}}}
+    <shard_dir>/train-00000.tar     <key>.jpg + <key>.json ({"label", "class"}) liền nhau
+"""
+
+import os, io, json, random, tarfile, warnings
+import multiprocessing as mp
+
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+def read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, "shards.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def iter_tar_samples(path):
+    """Yield (image_bytes, label) theo thứ tự trong shard."""
+    pending = {}
+    with tarfile.open(path, mode="r|") as tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            key, ext = os.path.splitext(member.name)
+            data = tf.extractfile(member).read()
+            entry = pending.setdefault(key, {})
+            entry["json" if ext == ".json" else "img"] = data
+            if "json" in entry and "img" in entry:
+                del pending[key]
+                yield entry["img"], int(json.loads(entry["json"])["label"])
+
+class ShardedImageDataset(IterableDataset):
+    def __init__(self, shard_dir, split, transform=None, shuffle=False,
+                 buffer_size=1000, seed=42):
+        manifest = read_manifest(shard_dir)
+        self.shard_dir = shard_dir
+        self.classes = manifest["classes"]
+        self.shards = manifest["splits"][split]["shards"]
+        self.count = manifest["splits"][split]["count"]
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size if shuffle else 0
+        self.seed = seed
+        self._epoch = mp.Value("i", 0)  # shared memory: worker đọc giá trị mới nhất mỗi lần __iter__
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def epoch(self):
+        return self._epoch.value
+
+    def set_epoch(self, epoch):
+        """Gọi trước mỗi epoch (trước iter(loader)) để đổi thứ tự shard / shuffle buffer."""
+        self._epoch.value = int(epoch)
+
+    def _decode(self, data, label):
+        img = Image.open(io.BytesIO(data))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, label
+
+    def __iter__(self):
+        info = get_worker_info()
+        wid, nw = (info.id, info.num_workers) if info is not None else (0, 1)
+        epoch = self.epoch
+        rng = random.Random(self.seed + 1000 * epoch + wid)
+
+        shards = list(self.shards)
+        if self.shuffle:
+            random.Random(self.seed + epoch).shuffle(shards)  # cùng thứ tự ở mọi worker
+        split_samples = len(shards) < nw
+        if split_samples:
+            if wid == 0 and nw > 1:
+                warnings.warn(f"{len(shards)} shard < {nw} worker → chia theo mẫu (mọi worker đọc mọi shard); "
+                              f"nên ghi nhiều shard hơn (giảm SHARD_SIZE_MB / tăng MIN_SHARDS)")
+        else:
+            shards = shards[wid::nw]
+
+        buf = []
+        j = -1
+        for name in shards:
+            for data, label in iter_tar_samples(os.path.join(self.shard_dir, name)):
+                j += 1
+                if split_samples and j % nw != wid:
+                    continue  # bỏ trước khi decode ảnh
+                if self.buffer_size <= 0:
+                    yield self._decode(data, label)
+                    continue
+                if len(buf) < self.buffer_size:
+                    buf.append((data, label))
+                    continue
+                i = rng.randrange(len(buf))
+                buf[i], (data, label) = (data, label), buf[i]
+                yield self._decode(data, label)
+        rng.shuffle(buf)
+        for data, label in buf:
+            yield self._decode(data, label)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""step_metrics.py
+
+Đo nhẹ từng bước train: chờ dữ liệu / copy host→device / compute, img/s, peak memory.
+
+Peak memory: GPU → "peak_mem_mb" (allocator, reset mỗi epoch);
+CPU → "process_peak_rss_mb" (ru_maxrss, peak của cả process từ lúc khởi động, không reset được).
+
+- Không sync mỗi bước: loss/correct cộng dồn trên device; trên GPU thời gian H2D và compute
+  đo bằng CUDA event, chỉ đọc ra một lần ở cuối epoch
+- Thời gian chờ dữ liệu đo phía host (thời gian next(loader) bị block)
+- Tùy chọn ghi log từng bước ra .jsonl hoặc .csv (ghi ở cuối epoch)
+
+    prof = StepProfiler(device, step_log="train_steps.jsonl")
+    prof.start_epoch(epoch)
+    for x, y in prof.wrap(train_loader):
+        x, y = x.to(device), y.to(device)
+        prof.h2d_done()
+        ...forward/backward/step...
+        prof.step_done(loss, logits, y)
+    summary = prof.end_epoch()
+"""
+
+import os, csv, json, time, resource
+
+import torch
+
+class StepProfiler:
+    def __init__(self, device, step_log=None):
+        self.device = torch.device(device)
+        self.cuda = self.device.type == "cuda"
+        self.step_log = step_log
+
+    def _event(self):
+        e = torch.cuda.Event(enable_timing=True)
+        e.record()
+        return e
+
+    def _mark(self):
+        """CUDA event (đọc sau) hoặc perf_counter (CPU chạy đồng bộ)."""
+        return self._event() if self.cuda else time.perf_counter()
+
+    def start_epoch(self, epoch=None):
+        self.epoch = epoch
+        self.steps = []                    # [(n, data_wait_s, t_data, t_h2d, t_done)]
+        self.loss_sum = torch.zeros((), device=self.device)
+        self.correct = torch.zeros((), dtype=torch.long, device=self.device)
+        self.total = 0
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.t_epoch = time.perf_counter()
+
+    def wrap(self, loader):
+        it = iter(loader)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                batch = next(it)
+            except StopIteration:
+                return
+            self._wait = time.perf_counter() - t0
+            self._t_data = self._mark()
+            yield batch
+
+    def h2d_done(self):
+        self._t_h2d = self._mark()
+
+    def step_done(self, loss, logits, y):
+        n = y.size(0)
+        self.loss_sum += loss.detach().float() * n
+        self.correct += (logits.detach().argmax(1) == y).sum()
+        self.total += n
+        self.steps.append((n, self._wait, self._t_data, self._t_h2d, self._mark()))
+
+    def _elapsed(self, a, b):
+        return a.elapsed_time(b) / 1000 if self.cuda else b - a
+
+    def end_epoch(self):
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+        epoch_s = time.perf_counter() - self.t_epoch
+
+        rows = []
+        for i, (n, wait, t_data, t_h2d, t_done) in enumerate(self.steps):
+            rows.append({
+                "epoch": self.epoch, "step": i, "batch_size": n,
+                "data_wait_ms": round(wait * 1000, 3),
+                "h2d_ms": round(self._elapsed(t_data, t_h2d) * 1000, 3),
+                "compute_ms": round(self._elapsed(t_h2d, t_done) * 1000, 3),
+            })
+        data_wait = sum(r["data_wait_ms"] for r in rows) / 1000
+        h2d = sum(r["h2d_ms"] for r in rows) / 1000
+        compute = sum(r["compute_ms"] for r in rows) / 1000
+
+        if self.cuda:
+            mem = {"peak_mem_mb": round(torch.cuda.max_memory_allocated(self.device) / 2**20, 1)}
+        else:
+            rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB (Linux), cộng dồn cả process
+            mem = {"process_peak_rss_mb": round(rss_kb / 1024, 1)}
+
+        total = max(self.total, 1)
+        summary = {
+            "epoch": self.epoch,
+            "loss": float(self.loss_sum) / total,
+            "acc": int(self.correct) / total,
+            "steps": len(rows),
+            "images": self.total,
+            "epoch_s": round(epoch_s, 3),
+            "data_wait_s": round(data_wait, 3),
+            "h2d_s": round(h2d, 3),
+            "compute_s": round(compute, 3),
+            "data_wait_frac": round(data_wait / max(epoch_s, 1e-9), 4),
+            "images_per_s": round(self.total / max(epoch_s, 1e-9), 1),
+            **mem,
+        }
+        if self.step_log:
+            self._write_steps(rows)
+        return summary
+
+    def _write_steps(self, rows):
+        if not rows:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.step_log)), exist_ok=True)
+        if self.step_log.endswith(".csv"):
+            new = not os.path.exists(self.step_log)
+            with open(self.step_log, "a", newline="", encoding="utf-8") as f:
+                w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                if new:
+                    w.writeheader()
+                w.writerows(rows)
+        else:
+            with open(self.step_log, "a", encoding="utf-8") as f:
+                for r in rows:
+                    f.write(json.dumps(r) + "\n")
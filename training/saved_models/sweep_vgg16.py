@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""sweep_vgg16.py
+
+Sweep siêu tham số song song cho fine-tune head VGG16 (features đóng băng).
+
+- Không gian tìm kiếm: grid hoặc random (JSON hoặc mặc định bên dưới)
+- Các trial chạy song song trong ProcessPool, mỗi trial được chia một phần CPU threads
+- Ảnh được decode + resize 224x224 MỘT lần vào cache .npy (uint8), các trial mở
+  read-only bằng mmap → không trial nào phải đọc/decode lại ảnh
+- Median stopping: trial bị dừng nếu best val acc tại epoch e < trung vị các trial khác tại epoch e
+- Kết quả gom vào 1 bảng leaderboard (CSV + in ra màn hình)
+
+Ví dụ:
+    python sweep_vgg16.py --data-dir /content/dataset --mode grid --parallel 4
+    python sweep_vgg16.py --data-dir /content/dataset --mode random --trials 16 --space space.json
+
+space.json:
+    {"lr": {"loguniform": [1e-5, 1e-3]}, "weight_decay": [0, 1e-4], "batch_size": [32, 64], "patience": [2, 3]}
+"""
+
+import os, json, time, math, random, argparse, itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torchvision import datasets, models, transforms
+from torchvision.models import VGG16_Weights
+from torch.utils.data import Dataset, DataLoader
+
+# ----------------- Mặc định (giống vgg16_model.py) -----------------
+DEFAULT_SPACE = {
+    "lr":           [1e-4, 3e-4, 1e-3],
+    "weight_decay": [0.0, 1e-4],
+    "batch_size":   [32, 64],
+    "patience":     [3],
+}
+SPLITS = ("train", "val", "test")
+
+imagenet_mean = [0.485, 0.456, 0.406]
+imagenet_std  = [0.229, 0.224, 0.225]
+
+# ----------------- Search space -----------------
+def _sample_value(spec, rng):
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    if isinstance(spec, dict) and "loguniform" in spec:
+        lo, hi = spec["loguniform"]
+        return float(math.exp(rng.uniform(math.log(lo), math.log(hi))))
+    if isinstance(spec, dict) and "uniform" in spec:
+        lo, hi = spec["uniform"]
+        return float(rng.uniform(lo, hi))
+    return spec
+
+def make_trials(space, mode="grid", n_trials=8, seed=42):
+    keys = sorted(space.keys())
+    if mode == "grid":
+        for k in keys:
+            assert isinstance(space[k], list), f"grid cần list giá trị cho '{k}'"
+        return [dict(zip(keys, vals)) for vals in itertools.product(*(space[k] for k in keys))]
+    rng = random.Random(seed)
+    return [{k: _sample_value(space[k], rng) for k in keys} for _ in range(n_trials)]
+
+# ----------------- Cache dữ liệu đã decode (dùng chung, read-only) -----------------
+def _cache_paths(cache_dir, split):
+    return (os.path.join(cache_dir, f"{split}_x.npy"),
+            os.path.join(cache_dir, f"{split}_y.npy"))
+
+def _cached_classes(cache_dir):
+    path = os.path.join(cache_dir, "classes.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("classes")
+
+def _cache_valid(x_path, y_path, n):
+    """Cache hợp lệ khi cả 2 file tồn tại và số dòng khớp số ảnh hiện tại của split."""
+    if not (os.path.exists(x_path) and os.path.exists(y_path)):
+        return False
+    try:
+        return (np.load(x_path, mmap_mode="r").shape[0] == n
+                and np.load(y_path, mmap_mode="r").shape[0] == n)
+    except (ValueError, OSError):
+        return False  # file hỏng / ghi dở
+
+def build_decoded_cache(data_dir, cache_dir, num_workers=4):
+    """
+    Decode + resize mỗi split một lần → uint8 (N,3,224,224) trong .npy.
+    Cache cũ chỉ được dùng lại khi danh sách lớp và số ảnh mỗi split khớp dataset hiện tại;
+    lệch → decode lại.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    classes = None
+    old_classes = _cached_classes(cache_dir)
+    decode_tfms = transforms.Compose([transforms.Resize((224, 224)), transforms.PILToTensor()])
+    for split in SPLITS:
+        x_path, y_path = _cache_paths(cache_dir, split)
+        ds = datasets.ImageFolder(os.path.join(data_dir, split), transform=decode_tfms)
+        classes = classes or ds.classes
+        if old_classes == ds.classes and _cache_valid(x_path, y_path, len(ds)):
+            print(f"✅ Cache có sẵn: {split} ({len(ds)} ảnh)")
+            continue
+        if os.path.exists(x_path):
+            print(f"♻️ Cache {split} không khớp dataset (classes / số ảnh) → decode lại")
+        print(f"📦 Decoding {split}: {len(ds)} ảnh → {x_path}")
+        x = np.lib.format.open_memmap(x_path + ".tmp", mode="w+", dtype=np.uint8, shape=(len(ds), 3, 224, 224))
+        y = np.empty(len(ds), dtype=np.int64)
+        pos = 0
+        for xb, yb in DataLoader(ds, batch_size=64, shuffle=False, num_workers=num_workers):
+            x[pos:pos + len(xb)] = xb.numpy()
+            y[pos:pos + len(yb)] = yb.numpy()
+            pos += len(xb)
+        x.flush(); del x
+        os.replace(x_path + ".tmp", x_path)  # .npy vẫn hợp lệ sau khi đổi tên
+        np.save(y_path, y)
+    with open(os.path.join(cache_dir, "classes.json"), "w", encoding="utf-8") as f:
+        json.dump({"classes": classes}, f, ensure_ascii=False, indent=2)
+    return classes
+
+class CachedSplit(Dataset):
+    """Đọc uint8 từ memmap; augmentation/normalize làm trên tensor."""
+    def __init__(self, cache_dir, split, train=False):
+        x_path, y_path = _cache_paths(cache_dir, split)
+        self.x = np.load(x_path, mmap_mode="r")
+        self.y = np.load(y_path)
+        self.norm = transforms.Normalize(imagenet_mean, imagenet_std)
+        self.aug = transforms.Compose([
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomRotation(10),
+            transforms.ColorJitter(0.2, 0.2, 0.2, 0.1),
+        ]) if train else None
+
+    def __len__(self):
+        return len(self.y)
+
+    def __getitem__(self, i):
+        img = torch.from_numpy(np.array(self.x[i])).float().div_(255.0)
+        if self.aug is not None:
+            img = self.aug(img)
+        return self.norm(img), int(self.y[i])
+
+# ----------------- Median stopping -----------------
+def should_stop(history, trial_id, epoch, min_epochs, min_trials):
+    """
+    history: {trial_id: [val_acc epoch1, epoch2, ...]} (dict chia sẻ giữa các process)
+    Dừng nếu best-so-far của trial < trung vị best-so-far của các trial khác tại cùng epoch.
+    """
+    if epoch < min_epochs:
+        return False
+    mine = max(history[trial_id][:epoch])
+    others = [max(v[:epoch]) for k, v in history.items() if k != trial_id and len(v) >= epoch]
+    if len(others) < min_trials:
+        return False
+    return mine < float(np.median(others))
+
+# ----------------- Một trial -----------------
+def _build_model(num_classes):
+    model = models.vgg16(weights=VGG16_Weights.DEFAULT)
+    for p in model.features.parameters():
+        p.requires_grad = False
+    model.classifier[6] = nn.Linear(4096, num_classes)
+    return model
+
+@torch.no_grad()
+def _evaluate(model, loader, device):
+    model.eval()
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+    for x, y in loader:
+        x = x.to(device).to(memory_format=torch.channels_last)
+        y = y.to(device)
+        correct += (model(x).argmax(1) == y).sum()
+        total += y.size(0)
+    return correct.item() / max(total, 1)
+
+def run_trial(trial_id, params, cfg, history):
+    """Cùng công thức train với vgg16_model.py: AdamW + ReduceLROnPlateau(val acc) + AMP khi có CUDA."""
+    torch.set_num_threads(cfg["threads_per_trial"])
+    torch.manual_seed(cfg["seed"] + trial_id)
+    device = torch.device(cfg["device"])
+    t0 = time.time()
+
+    train_ds = CachedSplit(cfg["cache_dir"], "train", train=True)
+    val_ds   = CachedSplit(cfg["cache_dir"], "val")
+    test_ds  = CachedSplit(cfg["cache_dir"], "test")
+    bs = int(params["batch_size"])
+    train_loader = DataLoader(train_ds, batch_size=bs, shuffle=True)
+    val_loader   = DataLoader(val_ds, batch_size=bs)
+    test_loader  = DataLoader(test_ds, batch_size=bs)
+
+    model = _build_model(cfg["num_classes"]).to(memory_format=torch.channels_last).to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()),
+                            lr=float(params["lr"]), weight_decay=float(params["weight_decay"]))
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="max", factor=0.5, patience=1)
+    use_amp = device.type == "cuda"
+    scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
+
+    history[trial_id] = []
+    best_val, best_state, patience, status, epoch = 0.0, None, 0, "completed", 0
+    for epoch in range(1, cfg["epochs"] + 1):
+        model.train()
+        for x, y in train_loader:
+            x = x.to(device).to(memory_format=torch.channels_last)
+            y = y.to(device)
+            optimizer.zero_grad(set_to_none=True)
+            with torch.cuda.amp.autocast(enabled=use_amp):
+                loss = criterion(model(x), y)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+
+        va_acc = _evaluate(model, val_loader, device)
+        scheduler.step(va_acc)
+        history[trial_id] = history[trial_id] + [va_acc]  # gán lại để Manager đồng bộ
+        print(f"  [trial {trial_id:02d}] epoch {epoch:02d} val_acc {va_acc:.4f}")
+
+        if va_acc >= best_val:
+            best_val, patience = va_acc, 0
+            best_state = {k: v.detach().clone() for k, v in model.classifier.state_dict().items()}
+        else:
+            patience += 1
+            if patience >= int(params["patience"]):
+                status = "early_stopped"
+                break
+        if should_stop(history, trial_id, epoch, cfg["min_epochs"], cfg["min_trials"]):
+            status = "pruned"
+            break
+
+    if best_state is not None:
+        model.classifier.load_state_dict(best_state)
+    te_acc = _evaluate(model, test_loader, device)
+    return {
+        "trial": trial_id, **params, "status": status, "epochs": epoch,
+        "best_val_acc": round(best_val, 4), "test_acc": round(te_acc, 4),
+        "wall_s": round(time.time() - t0, 1),
+    }
+
+# ----------------- Main -----------------
+def main():
+    ap = argparse.ArgumentParser(description="Parallel hyperparameter sweep (VGG16 head-only)")
+    ap.add_argument("--data-dir", default="/content/dataset")
+    ap.add_argument("--cache-dir", default="/content/sweep_cache")
+    ap.add_argument("--out", default="sweep_leaderboard.csv")
+    ap.add_argument("--space", default=None, help="JSON search space (mặc định: DEFAULT_SPACE)")
+    ap.add_argument("--mode", choices=["grid", "random"], default="grid")
+    ap.add_argument("--trials", type=int, default=8, help="số trial khi --mode random")
+    ap.add_argument("--parallel", type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    ap.add_argument("--epochs", type=int, default=10)
+    ap.add_argument("--min-epochs", type=int, default=2, help="median stopping bắt đầu từ epoch này")
+    ap.add_argument("--min-trials", type=int, default=2, help="số trial khác tối thiểu để so trung vị")
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space, "r", encoding="utf-8") as f:
+            space = json.load(f)
+    trials = make_trials(space, args.mode, args.trials, args.seed)
+
+    classes = build_decoded_cache(args.data_dir, args.cache_dir)
+    _build_model(len(classes))  # tải sẵn weights ImageNet 1 lần trước khi fork pool
+
+    cpu = os.cpu_count() or 1
+    parallel = max(1, min(args.parallel, len(trials)))
+    cfg = {
+        "cache_dir": args.cache_dir, "num_classes": len(classes),
+        "epochs": args.epochs, "min_epochs": args.min_epochs, "min_trials": args.min_trials,
+        "threads_per_trial": max(1, cpu // parallel), "device": args.device, "seed": args.seed,
+    }
+    print(f"🧪 {len(trials)} trials | parallel {parallel} | {cfg['threads_per_trial']} threads/trial | classes {classes}")
+
+    ctx = mp.get_context("spawn")
+    rows = []
+    t0 = time.time()
+    with ctx.Manager() as manager:
+        history = manager.dict()
+        with ProcessPoolExecutor(max_workers=parallel, mp_context=ctx) as pool:
+            futs = {pool.submit(run_trial, i, p, cfg, history): i for i, p in enumerate(trials)}
+            for fut in as_completed(futs):
+                try:
+                    row = fut.result()
+                except Exception as e:
+                    i = futs[fut]
+                    print(f"❌ trial {i} lỗi: {e}")
+                    row = {"trial": i, **trials[i], "status": f"failed: {e}"}
+                rows.append(row)
+                print(f"✅ trial {row['trial']:02d} {row['status']} | "
+                      f"val {row.get('best_val_acc', float('nan'))} | test {row.get('test_acc', float('nan'))}")
+
+    board = pd.DataFrame(rows)
+    if "best_val_acc" in board:
+        board = board.sort_values("best_val_acc", ascending=False, na_position="last")
+    board.to_csv(args.out, index=False, encoding="utf-8-sig")
+    print(f"\n🏁 Sweep xong sau {time.time() - t0:.1f}s — leaderboard: {args.out}\n")
+    print(board.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""tune_dataloader.py
+
+Tự dò cấu hình DataLoader cho vgg16_model.py trên phần cứng hiện tại.
+
+1) Đo RIÊNG tốc độ nạp dữ liệu (img/s) trên lưới num_workers × prefetch_factor × batch_size × pin_memory
+   (cùng train transforms với vgg16_model.py, không chạy model)
+2) Đo RIÊNG thời gian 1 bước train của model (forward + backward + optimizer.step) với tensor giả,
+   mặc định qua torch.compile như vgg16_model.py (--no-compile để đo eager)
+3) So sánh → pipeline đang input-bound hay compute-bound ở từng batch size
+4) Ghi loader_config.json; vgg16_model.py tự đọc file này nếu có
+
+Ví dụ:
+    python tune_dataloader.py --data-dir /content/dataset --out /content/drive/MyDrive/loader_config.json
+"""
+
+import os, json, time, argparse, itertools
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torchvision import datasets, models, transforms
+from torch.utils.data import DataLoader
+
+imagenet_mean = [0.485, 0.456, 0.406]
+imagenet_std  = [0.229, 0.224, 0.225]
+
+# giống train_tfms trong vgg16_model.py
+train_tfms = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.RandomHorizontalFlip(),
+    transforms.RandomRotation(10),
+    transforms.ColorJitter(0.2, 0.2, 0.2, 0.1),
+    transforms.ToTensor(),
+    transforms.Normalize(imagenet_mean, imagenet_std),
+])
+
+def loader_kwargs(batch_size, num_workers, prefetch_factor, pin_memory):
+    """prefetch_factor/persistent_workers chỉ hợp lệ khi num_workers > 0."""
+    kw = dict(batch_size=batch_size, num_workers=num_workers, pin_memory=pin_memory)
+    if num_workers > 0:
+        kw.update(prefetch_factor=prefetch_factor, persistent_workers=True)
+    return kw
+
+# ----------------- Đo data loading -----------------
+def measure_loader(ds, batch_size, num_workers, prefetch_factor, pin_memory,
+                   warmup=3, batches=20):
+    loader = DataLoader(ds, shuffle=True, drop_last=True,
+                        **loader_kwargs(batch_size, num_workers, prefetch_factor, pin_memory))
+    it = iter(loader)
+    n_img = 0
+    t0 = time.perf_counter()
+    try:
+        for _ in range(warmup):          # bỏ qua thời gian khởi động worker
+            next(it)
+        t0 = time.perf_counter()
+        for _ in range(batches):
+            x, _ = next(it)
+            n_img += x.size(0)
+        dt = time.perf_counter() - t0
+    except StopIteration:
+        dt = time.perf_counter() - t0 if n_img else float("inf")
+    finally:
+        del it, loader
+    return n_img / dt if dt > 0 else 0.0
+
+# ----------------- Đo compute -----------------
+def measure_step(batch_size, num_classes, device, warmup=3, steps=10, compile=True):
+    # weights=None: tốc độ không phụ thuộc giá trị weights, khỏi tải ImageNet
+    model = models.vgg16(weights=None)
+    for p in model.features.parameters():
+        p.requires_grad = False
+    model.classifier[6] = nn.Linear(4096, num_classes)
+    model = model.to(memory_format=torch.channels_last).to(device).train()
+    if compile:
+        try:
+            model = torch.compile(model)   # giống vgg16_model.py; thời gian compile nằm trong warmup
+        except Exception as e:
+            print("ℹ️ torch.compile not available:", e)
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()), lr=1e-4)
+    use_amp = device.type == "cuda"
+    scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
+    x = torch.randn(batch_size, 3, 224, 224, device=device).to(memory_format=torch.channels_last)
+    y = torch.randint(0, num_classes, (batch_size,), device=device)
+
+    def step():
+        optimizer.zero_grad(set_to_none=True)
+        with torch.cuda.amp.autocast(enabled=use_amp):
+            loss = criterion(model(x), y)
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+
+    for _ in range(warmup):
+        step()
+    if use_amp:
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        step()
+    if use_amp:
+        torch.cuda.synchronize()
+    dt = (time.perf_counter() - t0) / steps
+    del model, optimizer
+    if use_amp:
+        torch.cuda.empty_cache()
+    return dt, batch_size / dt
+
+# ----------------- Main -----------------
+def main():
+    cpu = os.cpu_count() or 2
+    has_cuda = torch.cuda.is_available()
+    ap = argparse.ArgumentParser(description="DataLoader throughput auto-tuner")
+    ap.add_argument("--data-dir", default="/content/dataset")
+    ap.add_argument("--split", default="train")
+    ap.add_argument("--out", default="loader_config.json")
+    ap.add_argument("--workers", type=int, nargs="+",
+                    default=sorted({w for w in (0, 2, 4, 8, cpu - 1) if 0 <= w <= cpu}))
+    ap.add_argument("--prefetch", type=int, nargs="+", default=[2, 4])
+    ap.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 64, 96])
+    ap.add_argument("--pin-memory", type=int, nargs="+", default=[0, 1] if has_cuda else [0])
+    ap.add_argument("--batches", type=int, default=20, help="số batch đo cho mỗi cấu hình loader")
+    ap.add_argument("--steps", type=int, default=10, help="số bước đo cho compute")
+    ap.add_argument("--compile", action=argparse.BooleanOptionalAction, default=True,
+                    help="đo compute qua torch.compile như lúc train (--no-compile: eager)")
+    ap.add_argument("--tolerance", type=float, default=0.95,
+                    help="chọn cấu hình rẻ nhất đạt ≥ tolerance × throughput tốt nhất")
+    args = ap.parse_args()
+
+    device = torch.device("cuda" if has_cuda else "cpu")
+    torch.backends.cudnn.benchmark = True
+    ds = datasets.ImageFolder(os.path.join(args.data_dir, args.split), transform=train_tfms)
+    num_classes = len(ds.classes)
+    print(f"🖥️ Device: {device} | CPU: {cpu} | {args.split}: {len(ds)} ảnh, {num_classes} lớp | "
+          f"compile {'on' if args.compile else 'off'}")
+
+    # 1) compute-only
+    compute = {}
+    for bs in args.batch_sizes:
+        try:
+            step_s, ips = measure_step(bs, num_classes, device, steps=args.steps, compile=args.compile)
+        except RuntimeError as e:  # OOM...
+            print(f"⚠️ batch {bs}: compute lỗi ({e}) → bỏ")
+            continue
+        compute[bs] = {"step_ms": round(step_s * 1000, 2), "images_per_s": round(ips, 1)}
+        print(f"🧠 compute  bs={bs:3d}: {step_s*1000:8.1f} ms/step → {ips:8.1f} img/s")
+
+    # 2) data-only
+    results = []
+    for bs, nw, pf, pin in itertools.product(compute.keys(), args.workers, args.prefetch, args.pin_memory):
+        if nw == 0 and pf != args.prefetch[0]:
+            continue  # prefetch không có tác dụng khi num_workers=0
+        ips = measure_loader(ds, bs, nw, pf, bool(pin), batches=args.batches)
+        results.append({"batch_size": bs, "num_workers": nw, "prefetch_factor": pf,
+                        "pin_memory": bool(pin), "loader_images_per_s": round(ips, 1)})
+        print(f"📦 loader   bs={bs:3d} workers={nw:2d} prefetch={pf} pin={int(pin)}: {ips:8.1f} img/s")
+
+    # 3) phân tích theo batch size
+    summary = {}
+    for bs, c in compute.items():
+        cands = [r for r in results if r["batch_size"] == bs]
+        if not cands:
+            continue
+        best = max(r["loader_images_per_s"] for r in cands)
+        # cấu hình rẻ nhất (ít worker, prefetch nhỏ) vẫn đủ nhanh
+        target = min(best, c["images_per_s"]) * args.tolerance
+        cheap = min((r for r in cands if r["loader_images_per_s"] >= target),
+                    key=lambda r: (r["num_workers"], r["prefetch_factor"], r["pin_memory"]))
+        bound = "input" if best < c["images_per_s"] else "compute"
+        summary[bs] = {**cheap, "compute_images_per_s": c["images_per_s"], "step_ms": c["step_ms"],
+                       "best_loader_images_per_s": best, "bound": bound,
+                       "expected_images_per_s": round(min(best, c["images_per_s"]), 1)}
+        print(f"🔎 bs={bs:3d}: {bound}-bound | loader {best:.1f} vs compute {c['images_per_s']:.1f} img/s")
+
+    assert summary, "Không đo được cấu hình nào"
+    rec = max(summary.values(), key=lambda s: s["expected_images_per_s"])
+    config = {
+        "batch_size": rec["batch_size"],
+        "num_workers": rec["num_workers"],
+        "prefetch_factor": rec["prefetch_factor"],
+        "pin_memory": rec["pin_memory"],
+        "bound": rec["bound"],
+        "expected_images_per_s": rec["expected_images_per_s"],
+        "device": str(device),
+        "compile": args.compile,
+        "cpu_count": cpu,
+        "per_batch_size": {str(k): v for k, v in summary.items()},
+        "loader_results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Đề xuất: batch {rec['batch_size']} | workers {rec['num_workers']} | "
+          f"prefetch {rec['prefetch_factor']} | pin {rec['pin_memory']} ({rec['bound']}-bound)")
+    print(f"✅ loader_config.json saved: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@ import torch.backends.cudnn as cudnn
 from torchvision import datasets, models, transforms
 from torchvision.models import VGG16_Weights
 from torch.utils.data import DataLoader
+from step_metrics import StepProfiler     # step_metrics.py đặt cùng thư mục
 from sklearn.metrics import classification_report, confusion_matrix
 
 # ----------------- Config -----------------
@@ -35,6 +36,13 @@ LOCAL_DATA_DIR = "/content/dataset"       # bản sao cục bộ để train nha
 COPY_LOCAL     = True                     # copy từ Drive về local (rất nên bật)
 OVERWRITE_COPY = True                     # xóa local cũ trước khi copy
 
+# Tar shard (processed_fruit_dataset_2cls.py → write_tar_shards): stream trực tiếp, bỏ bước copy
+USE_SHARDS     = None                     # None = tự dùng nếu có SHARD_DIR/shards.json; False = ép ImageFolder
+SHARD_DIR      = "/content/drive/MyDrive/processed_fruit_dataset_shards"  # local disk hoặc Drive mount
+SHUFFLE_BUFFER = 1000                     # số mẫu giữ trong buffer để xáo trộn
+if USE_SHARDS is None:
+    USE_SHARDS = os.path.exists(os.path.join(SHARD_DIR, "shards.json"))
+
 # Nơi lưu output (trên Drive)
 SAVE_DIR   = "/content/drive/MyDrive"
 MODEL_PATH = os.path.join(SAVE_DIR, "vgg16_fruit_model_2cls.pth")
@@ -42,6 +50,7 @@ CLASSES_JSON = os.path.join(SAVE_DIR, "classes.json")
 METRICS_JSON = os.path.join(SAVE_DIR, "metrics.json")
 CM_PNG       = os.path.join(SAVE_DIR, "confusion_matrix.png")
 CM_CSV       = os.path.join(SAVE_DIR, "confusion_matrix.csv")
+STEP_LOG     = None                       # vd: os.path.join(SAVE_DIR, "train_steps.jsonl") hoặc .csv
 
 # Train params
 BATCH_SIZE   = 64               # tăng nếu VRAM cho phép (32/64/96)
@@ -57,6 +66,23 @@ NUM_WORKERS = min(8, max(2, CPU_COUNT - 1))   # ví dụ: 3/7 workers tùy máy
 PREFETCH_FACTOR = 4
 PIN_MEMORY = True
 
+# Cấu hình do tune_dataloader.py đề xuất (nếu có) → ghi đè các giá trị trên
+LOADER_CONFIG = os.path.join(SAVE_DIR, "loader_config.json")
+if os.path.exists(LOADER_CONFIG):
+    with open(LOADER_CONFIG, "r", encoding="utf-8") as f:
+        _lc = json.load(f)
+    BATCH_SIZE      = int(_lc.get("batch_size", BATCH_SIZE))
+    NUM_WORKERS     = int(_lc.get("num_workers", NUM_WORKERS))
+    PREFETCH_FACTOR = int(_lc.get("prefetch_factor", PREFETCH_FACTOR))
+    PIN_MEMORY      = bool(_lc.get("pin_memory", PIN_MEMORY))
+    print(f"⚙️ Loader config từ {LOADER_CONFIG}: batch {BATCH_SIZE} | workers {NUM_WORKERS} | "
+          f"prefetch {PREFETCH_FACTOR} | pin {PIN_MEMORY} ({_lc.get('bound', '?')}-bound)")
+
+# prefetch_factor/persistent_workers chỉ hợp lệ khi num_workers > 0
+LOADER_KW = dict(num_workers=NUM_WORKERS, pin_memory=PIN_MEMORY)
+if NUM_WORKERS > 0:
+    LOADER_KW.update(persistent_workers=True, prefetch_factor=PREFETCH_FACTOR)
+
 # ----------------- Seed & device -----------------
 def set_seed(seed=42):
     random.seed(seed); np.random.seed(seed)
@@ -72,7 +98,9 @@ except Exception:
 print("🖥️ Device:", device, "| CPU:", CPU_COUNT, "| workers:", NUM_WORKERS)
 
 # ----------------- Copy dataset to local (fast I/O) -----------------
-if COPY_LOCAL:
+if USE_SHARDS:
+    DATA_DIR = SHARD_DIR                  # đọc tuần tự từ shard, không cần copy
+elif COPY_LOCAL:
     if OVERWRITE_COPY and os.path.exists(LOCAL_DATA_DIR):
         shutil.rmtree(LOCAL_DATA_DIR)
     if not os.path.exists(LOCAL_DATA_DIR):
@@ -103,30 +131,26 @@ eval_tfms = transforms.Compose([
 ])
 
 # ----------------- Datasets & Loaders -----------------
-train_ds = datasets.ImageFolder(os.path.join(DATA_DIR, "train"), transform=train_tfms)
-val_ds   = datasets.ImageFolder(os.path.join(DATA_DIR, "val"),   transform=eval_tfms)
-test_ds  = datasets.ImageFolder(os.path.join(DATA_DIR, "test"),  transform=eval_tfms)
+if USE_SHARDS:
+    from shard_dataset import ShardedImageDataset  # shard_dataset.py đặt cùng thư mục
+    train_ds = ShardedImageDataset(DATA_DIR, "train", train_tfms, shuffle=True,
+                                   buffer_size=SHUFFLE_BUFFER, seed=SEED)
+    val_ds   = ShardedImageDataset(DATA_DIR, "val",   eval_tfms)
+    test_ds  = ShardedImageDataset(DATA_DIR, "test",  eval_tfms)
+else:
+    train_ds = datasets.ImageFolder(os.path.join(DATA_DIR, "train"), transform=train_tfms)
+    val_ds   = datasets.ImageFolder(os.path.join(DATA_DIR, "val"),   transform=eval_tfms)
+    test_ds  = datasets.ImageFolder(os.path.join(DATA_DIR, "test"),  transform=eval_tfms)
 
 class_names = train_ds.classes
 num_classes = len(class_names)
 assert num_classes >= 2, f"Dataset cần ≥2 lớp. Hiện có: {class_names}"
 print(f"📚 Classes ({num_classes}): {class_names}")
 
-train_loader = DataLoader(
-    train_ds, batch_size=BATCH_SIZE, shuffle=True,
-    num_workers=NUM_WORKERS, pin_memory=PIN_MEMORY,
-    persistent_workers=True, prefetch_factor=PREFETCH_FACTOR
-)
-val_loader = DataLoader(
-    val_ds, batch_size=BATCH_SIZE, shuffle=False,
-    num_workers=NUM_WORKERS, pin_memory=PIN_MEMORY,
-    persistent_workers=True, prefetch_factor=PREFETCH_FACTOR
-)
-test_loader = DataLoader(
-    test_ds, batch_size=BATCH_SIZE, shuffle=False,
-    num_workers=NUM_WORKERS, pin_memory=PIN_MEMORY,
-    persistent_workers=True, prefetch_factor=PREFETCH_FACTOR
-)
+# IterableDataset tự xáo (shard + buffer) → DataLoader không được shuffle
+train_loader = DataLoader(train_ds, batch_size=BATCH_SIZE, shuffle=not USE_SHARDS, **LOADER_KW)
+val_loader   = DataLoader(val_ds,   batch_size=BATCH_SIZE, shuffle=False, **LOADER_KW)
+test_loader  = DataLoader(test_ds,  batch_size=BATCH_SIZE, shuffle=False, **LOADER_KW)
 
 # ----------------- Model -----------------
 model = models.vgg16(weights=VGG16_Weights.DEFAULT)
@@ -150,13 +174,17 @@ scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="max", factor=0
 scaler = torch.cuda.amp.GradScaler(enabled=torch.cuda.is_available())
 
 # ----------------- Train/Eval -----------------
-def train_one_epoch():
+prof = StepProfiler(device, step_log=STEP_LOG)
+
+def train_one_epoch(epoch=None):
+    """loss/acc cộng dồn trên device (không .item() mỗi bước) + thời gian chờ data / H2D / compute."""
     model.train()
-    loss_sum, correct, total = 0.0, 0, 0
-    for x, y in train_loader:
+    prof.start_epoch(epoch)
+    for x, y in prof.wrap(train_loader):
         # dùng channels_last cho tensor input
         x = x.to(device, non_blocking=True).to(memory_format=torch.channels_last)
         y = y.to(device, non_blocking=True)
+        prof.h2d_done()
 
         optimizer.zero_grad(set_to_none=True)
         with torch.cuda.amp.autocast(enabled=torch.cuda.is_available()):
@@ -166,11 +194,9 @@ def train_one_epoch():
         scaler.step(optimizer)
         scaler.update()
 
-        pred = logits.argmax(1)
-        loss_sum += loss.item() * x.size(0)
-        correct  += (pred == y).sum().item()
-        total    += y.size(0)
-    return loss_sum/max(total,1), correct/max(total,1)
+        prof.step_done(loss, logits, y)
+    perf = prof.end_epoch()
+    return perf.pop("loss"), perf.pop("acc"), perf
 
 @torch.no_grad()
 def evaluate(loader):
@@ -189,9 +215,12 @@ def evaluate(loader):
 
 best_val_acc, best_state, patience = 0.0, None, 0
 history = []
+perf_history = []
 
 for epoch in range(1, NUM_EPOCHS + 1):
-    tr_loss, tr_acc = train_one_epoch()
+    if USE_SHARDS:
+        train_ds.set_epoch(epoch)  # mp.Value dùng chung → worker persistent cũng thấy epoch mới
+    tr_loss, tr_acc, perf = train_one_epoch(epoch)
     va_loss, va_acc = evaluate(val_loader)
     scheduler.step(va_acc)
 
@@ -203,6 +232,12 @@ for epoch in range(1, NUM_EPOCHS + 1):
     print(f"Epoch {epoch:02d}/{NUM_EPOCHS} | "
           f"Train: loss {tr_loss:.4f} acc {tr_acc:.4f} | "
           f"Val:   loss {va_loss:.4f} acc {va_acc:.4f}")
+    perf_history.append(perf)
+    # GPU: peak allocator của epoch; CPU: peak RSS của cả process (cộng dồn từ lúc khởi động)
+    peak = perf.get("peak_mem_mb", perf.get("process_peak_rss_mb"))
+    print(f"   ⏱️ {perf['epoch_s']:.1f}s | data wait {perf['data_wait_s']:.1f}s ({perf['data_wait_frac']:.0%}) | "
+          f"H2D {perf['h2d_s']:.1f}s | compute {perf['compute_s']:.1f}s | "
+          f"{perf['images_per_s']:.0f} img/s | peak {peak:.0f} MB")
 
     if va_acc >= best_val_acc:
         best_val_acc, best_state, patience = va_acc, model.state_dict(), 0
@@ -277,7 +312,8 @@ with open(METRICS_JSON, "w", encoding="utf-8") as f:
         "best_val_acc": float(best_val_acc),
         "test_loss": float(te_loss),
         "test_acc": float(te_acc),
-        "history": history
+        "history": history,
+        "perf": perf_history
     }, f, ensure_ascii=False, indent=2)
 
 print(f"✅ Model saved: {MODEL_PATH}")